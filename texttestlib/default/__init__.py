@@ -8,7 +8,6 @@ import texttestlib.default.sandbox
 import texttestlib.default.console
 import texttestlib.default.rundependent
 import texttestlib.default.comparetest
-import texttestlib.default.batch
 import texttestlib.default.performance
 from .. import plugins
 from copy import copy
@@ -79,6 +78,8 @@ class Config:
                 group.addOption("m", self.getMachineLabel(), self.getMachineNameForDisplay(machine))
                 group.addOption("cp", "Times to run", 1, minimum=1, maximum=10000,
                                 description="Set this to some number larger than 1 to run the same test multiple times, for example to try to catch indeterminism in the system under test")
+                group.addOption("j", "Tests to run in parallel", 1, minimum=1, maximum=1000,
+                                description="Set this to some number larger than 1 to run that many tests at the same time, in separate threads of this process")
                 if recordsUseCases:
                     group.addOption("delay", "Replay pause (sec)", 0.0,
                                     description="How long to wait, in seconds, between replaying each GUI action in the usecase file")
@@ -111,6 +112,7 @@ class Config:
                 group.addOption("s", "Run this script")
                 group.addOption("d", "Look for test files under")
                 group.addSwitch("help", "Print configuration help text on stdout")
+                group.addSwitch("profile-startup", "Print how long each phase of starting up took")
                 group.addSwitch("g", "use dynamic GUI")
                 group.addSwitch("gx", "use static GUI")
                 group.addSwitch("con", "use console interface")
@@ -392,6 +394,7 @@ class Config:
             classes += self.getThreadActionClasses()
 
         if self.batchMode() and not self.runningScript():
+            from . import batch
             if "coll" in self.optionMap:
                 arg = self.optionMap["coll"]
                 if arg != "mail":
@@ -592,6 +595,8 @@ class Config:
         extractors = app.getConfigValue("performance_logfile_extractor")
         if (perfType and perfType in extractors) or (not perfType and len(extractors) > 0):
             return True
+        elif perfType in ("", "memory") and app.getConfigValue("measure_memory_usage") != "false":
+            return True
         else:
             return app.hasAutomaticCputimeChecking()
 
@@ -735,7 +740,8 @@ class Config:
                 filters.append(performance.TimeFilter(timeLimit))
         if "grep" in optionMap:
             grepFile = optionMap.get("grepfile", app.getConfigValue("log_file"))
-            filters.append(GrepFilter(optionMap["grep"], grepFile, **kw))
+            indexFile = app.getConfigValue("grep_index_file")
+            filters.append(GrepFilter(optionMap["grep"], grepFile, indexFile=indexFile, **kw))
         return filters
 
     def batchMode(self):
@@ -881,7 +887,8 @@ class Config:
 
     def getStateSaver(self):
         if self.actualBatchMode():
-            return batch.SaveState
+            from .batch import SaveState as BatchSaveState
+            return BatchSaveState
         elif self.keepTemporaryDirectories() or "rerun" in self.optionMap:
             return SaveState
 
@@ -899,7 +906,8 @@ class Config:
         return console.InteractiveResponder
 
     def getWebPageResponder(self):
-        return batch.WebPageResponder
+        from .batch import WebPageResponder
+        return WebPageResponder
 
     # Utilities, which prove useful in many derived classes
     def optionValue(self, option):
@@ -961,8 +969,10 @@ class Config:
             raise plugins.TextTestError(
                 "Must provide '-b' argument to identify the batch session when running with '-coll' to collect batch run data")
         self.optionIntValue("delay", optionType=float)  # throws if it's not numeric...
+        self.optionIntValue("j", 1)
         if batchSession is not None and "coll" not in self.optionMap:
-            batchFilter = batch.BatchVersionFilter(batchSession)
+            from .batch import BatchVersionFilter
+            batchFilter = BatchVersionFilter(batchSession)
             batchFilter.verifyVersions(suite.app)
         if self.isReconnecting():
             self.reconnectConfig.checkSanity(suite.app)
@@ -1251,6 +1261,10 @@ class Config:
                              "Which result file to collect performance data from")
         app.setConfigDefault("performance_logfile_extractor", {},
                              "What string to look for when collecting performance data")
+        app.setConfigDefault("measure_memory_usage", "false",
+                             "(UNIX) Write the peak memory of the test process to the 'memory' file? ('true', or 'tree' to include its child processes)")
+        app.setConfigDefault("memory_sampling_interval", 0.1,
+                             "How often to sample the memory of all test processes, in seconds, when measure_memory_usage is 'tree'")
         app.setConfigDefault("performance_test_machine", {"default": [], "*mem*": ["any"]},
                              "List of machines where performance can be collected")
         app.setConfigDefault("performance_variation_%", {"default": 10.0},
@@ -1267,6 +1281,12 @@ class Config:
                              "Descriptions to be used when the numbers increase in a performance file")
         app.setConfigDefault("performance_unit", self.defaultPerfUnits(),
                              "Name to be used to identify the units in a performance file")
+        app.setConfigDefault("performance_history_location", "",
+                             "Directory where batch runs saved to the repository record their performance measurements")
+        app.setConfigDefault("performance_history_runs", {"default": 0},
+                             "How many recorded runs to compare performance with, instead of the approved figure")
+        app.setConfigDefault("performance_history_tolerance", {"default": 3.0},
+                             "How many standard deviations (estimated as 1.4826 times the median absolute deviation) from the median of recorded runs performance can vary. Changes within performance_variation_% are never significant")
         app.setConfigDefault("performance_ignore_improvements", {
                              "default": "false"}, "Should we ignore all improvements in performance?")
         app.setConfigAlias("performance_use_normalised_%", "use_normalised_percentage_change")
@@ -1380,8 +1400,14 @@ class Config:
                              "Mapping of patterns to remove from result files", trackFiles=True)
         app.setConfigDefault("unordered_text", {"default": []},
                              "Mapping of patterns to extract and sort from result files", trackFiles=True)
+        app.setConfigDefault("filtered_file_cache", "",
+                             "Directory to keep filtered approved files in between runs. Empty means no caching")
+        app.setConfigDefault("filtered_file_cache_max_size", 1024,
+                             "Maximum size of the filtered file cache, in megabytes")
         app.setConfigDefault("file_split_pattern", {}, "Pattern to use for splitting result files")
         app.setConfigDefault("create_catalogues", "false", "Do we create a listing of files created/removed by tests")
+        app.setConfigDefault("catalogue_exact_changes", "false",
+                             "Do catalogues compare size, inode and exact modification time, rather than modification time to the second")
         app.setConfigDefault("catalogue_process_string", "",
                              "String for catalogue functionality to identify processes created")
         app.setConfigDefault(
@@ -1439,7 +1465,7 @@ class Config:
 
     def setExternalToolDefaults(self, app, homeOS):
         app.setConfigDefault("text_diff_program", "diff",
-                             "External program to use for textual comparison of files")
+                             "External program to use for textual comparison of files, or 'builtin' to compare them within TextTest")
         app.setConfigDefault("lines_of_text_difference", 30,
                              "How many lines to present in textual previews of file diffs")
         app.setConfigDefault("max_width_text_difference", 500,
@@ -1447,7 +1473,7 @@ class Config:
         app.setConfigDefault("max_file_size", {
                              "default": "-1"}, "The maximum file size to load into external programs, in bytes. -1 means no limit.")
         app.setConfigDefault("text_diff_program_filters", {"default": [], "diff": [
-                             "^<", "^>"]}, "Filters that should be applied for particular diff tools to aid with grouping in dynamic GUI")
+                             "^<", "^>"], "builtin": ["^<", "^>"]}, "Filters that should be applied for particular diff tools to aid with grouping in dynamic GUI")
         app.setConfigDefault("diff_program", {"default": self.defaultDiffProgram()},
                              "External program to use for graphical file comparison")
         app.setConfigDefault("view_program", {"default": self.defaultViewProgram(homeOS)},
@@ -1622,6 +1648,10 @@ class Config:
         # Applies to any interface...
         app.setConfigDefault("auto_sort_test_suites", 0,
                              "Automatically sort test suites in alphabetical order. 1 means sort in ascending order, -1 means sort in descending order.")
+        app.setConfigDefault("grep_index_file", "",
+                             "File to keep an index of approved file contents in, to speed up selecting tests by file contents. Empty means no index")
+        app.setConfigDefault("test_suite_read_threads", 8,
+                             "Number of threads to use for reading test directories when loading the test suite")
         app.setConfigDefault("extra_test_process_postfix", [],
                              "Postfixes to use on ordinary files to denote an additional run of the SUT to be triggered")
         app.addConfigEntry("builtin", "options", "definition_file_stems")
@@ -1691,6 +1721,9 @@ class OrFilter(plugins.Filter):
     def contentsAccepted(self, suite, filters):
         return reduce(operator.and_, (filter.acceptsTestSuiteContents(suite) for filter in filters), True)
 
+    def acceptsTestPath(self, suite, relPath):
+        return any(all(filter.acceptsTestPath(suite, relPath) for filter in filters) for filters in self.filterLists)
+
 
 class NotFilter(plugins.Filter):
     def __init__(self, filters):
@@ -1719,10 +1752,24 @@ class TestRelPathFilter(plugins.TextFilter):
 
 
 class GrepFilter(plugins.TextFilter):
-    def __init__(self, filterText, fileStem, useTmpFiles=False):
+    def __init__(self, filterText, fileStem, useTmpFiles=False, indexFile=""):
         plugins.TextFilter.__init__(self, filterText)
         self.fileStem = fileStem
         self.useTmpFiles = useTmpFiles
+        self.contentIndex, self.gramHashLists = self.getContentIndex(indexFile)
+
+    def getContentIndex(self, indexFile):
+        if not indexFile or self.useTmpFiles or self.fileStem == "free_text":
+            return None, []
+        from .contentindex import ContentIndex, getGramHashes
+        gramHashLists = []
+        for trigger in self.textTriggers:
+            gramHashes = getGramHashes(trigger.text.encode("utf-8"))
+            # Regular expressions and very short words can't be looked up, so everything has to be searched
+            if trigger.regex or len(gramHashes) == 0:
+                return None, []
+            gramHashLists.append(gramHashes)
+        return ContentIndex.get(indexFile), gramHashLists
 
     def acceptsTestCase(self, test):
         if self.fileStem == "free_text":
@@ -1756,6 +1803,8 @@ class GrepFilter(plugins.TextFilter):
         return logFiles
 
     def matches(self, logFile):
+        if self.contentIndex and not self.contentIndex.mightContainAny(logFile, self.gramHashLists):
+            return False
         for line in open(logFile, errors="ignore"):
             if self.stringContainsText(line):
                 return True
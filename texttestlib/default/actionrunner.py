@@ -5,7 +5,7 @@ import types
 from texttestlib import plugins
 from queue import Queue, Empty
 from collections import OrderedDict
-from threading import Lock
+from threading import Lock, Thread, Condition
 
 plugins.addCategory("cancelled", "cancelled", "were cancelled before starting")
 
@@ -121,63 +121,196 @@ class BaseActionRunner(plugins.Responder, plugins.Observable):
 class ActionRunner(BaseActionRunner):
     def __init__(self, optionMap, *args):
         BaseActionRunner.__init__(self, optionMap, logging.getLogger("Action Runner"))
-        self.currentTestRunner = None
-        self.previousTestRunner = None
-        self.appRunners = OrderedDict()
+        self.appSuites = OrderedDict()
+        self.workers = [ActionWorker(self)]
+        self.sharedSuites = SharedSuiteSetUp(self.lock, self.diag)
+
+    def addTest(self, test):
+        self.sharedSuites.addTest(test)
+        BaseActionRunner.addTest(self, test)
 
     def addSuite(self, suite):
         plugins.log.info("Using " + suite.app.description(includeCheckout=True))
-        appRunner = ApplicationRunner(suite, self.diag)
-        self.appRunners[suite.app] = appRunner
+        self.appSuites[suite.app] = suite
+        self.workers[0].addSuite(suite)
 
     def notifyAllReadAndNotified(self):
         # kicks off processing. Don't use notifyAllRead as we end up running all the tests before
         # everyone's been notified of the reading.
         self.runAllTests()
 
+    def getWorkerCount(self):
+        # Scripts and recording might interact with the user or share state between tests, so never run them in parallel.
+        # Each worker sets up the application for its own actions, reconnecting would report doing so for each one
+        if self.optionMap.runScript() or "record" in self.optionMap or "coll" in self.optionMap or \
+                "reconnect" in self.optionMap:
+            return 1
+        try:
+            return max(int(self.optionMap.get("j", 1)), 1)
+        except (TypeError, ValueError):
+            return 1
+
+    def runAllTests(self):
+        workerCount = self.getWorkerCount()
+        if workerCount == 1:
+            return BaseActionRunner.runAllTests(self)
+
+        self.diag.info("Running tests in " + str(workerCount) + " parallel threads")
+        for _ in range(workerCount - 1):
+            worker = ActionWorker(self)
+            for suite in list(self.appSuites.values()):
+                worker.addSuite(suite)
+            self.workers.append(worker)
+
+        threads = []
+        for worker in self.workers:
+            thread = Thread(target=self.runQueue, args=(self.getParallelTestForRun, worker.runTest, "running"))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.cleanup()
+        self.diag.info("Terminating")
+
+    def getParallelTestForRun(self, block=True):
+        # Leave the terminator in the queue, so all the other workers also find it
+        return self.getItemFromQueue(self.testQueue, block=block, replaceTerminators=True)
+
+    def findCurrentTestRunner(self, test):
+        for worker in self.workers:
+            if worker.currentTestRunner and worker.currentTestRunner.test is test:
+                return worker.currentTestRunner
+
     def notifyRerun(self, test):
-        if self.currentTestRunner and self.currentTestRunner.test is test:
+        testRunner = self.findCurrentTestRunner(test)
+        if testRunner:
             self.diag.info("Got rerun notification for " + repr(test) + ", resetting actions")
-            self.currentTestRunner.resetActionSequence()
+            testRunner.resetActionSequence()
 
     def runTest(self, test):
-        # We have the lock coming in to here...
-        appRunner = self.appRunners.get(test.app)
-        if appRunner:
-            self.lock.acquire()
-            self.currentTestRunner = TestRunner(test, appRunner, self.diag, self.exited, self.killSignal)
-            self.lock.release()
-
-            self.currentTestRunner.performActions(self.previousTestRunner)
-            self.previousTestRunner = self.currentTestRunner
-
-            self.lock.acquire()
-            self.currentTestRunner = None
-            self.notifyComplete(test)
-            self.lock.release()
+        self.workers[0].runTest(test)
 
     def killTests(self):
-        if self.currentTestRunner:
-            self.currentTestRunner.kill(self.killSignal)
+        for worker in self.workers:
+            if worker.currentTestRunner:
+                worker.currentTestRunner.kill(self.killSignal)
 
     def killOrCancel(self, test):
-        if self.currentTestRunner and self.currentTestRunner.test is test:
-            self.currentTestRunner.kill()
+        testRunner = self.findCurrentTestRunner(test)
+        if testRunner:
+            testRunner.kill()
         else:
             self.cancel(test)
 
     def getAllActionClasses(self):
         classes = set()
-        for appRunner in list(self.appRunners.values()):
-            for action in appRunner.actionSequence:
-                classes.add(action.__class__)
+        for worker in self.workers:
+            for appRunner in list(worker.appRunners.values()):
+                for action in appRunner.actionSequence:
+                    classes.add(action.__class__)
         return classes
 
     def cleanup(self):
         for actionClass in self.getAllActionClasses():
             actionClass.finalise()
-        for appRunner in list(self.appRunners.values()):
-            appRunner.cleanActions()
+        for worker in self.workers:
+            for appRunner in list(worker.appRunners.values()):
+                appRunner.cleanActions()
+
+
+class ActionWorker:
+    """ Runs tests one at a time with its own action sequences, so that several of these can run tests in parallel """
+    def __init__(self, actionRunner):
+        self.actionRunner = actionRunner
+        self.diag = actionRunner.diag
+        self.currentTestRunner = None
+        self.previousTestRunner = None
+        self.appRunners = OrderedDict()
+
+    def addSuite(self, suite):
+        self.appRunners[suite.app] = ApplicationRunner(suite, self.diag)
+
+    def runTest(self, test):
+        appRunner = self.appRunners.get(test.app)
+        if appRunner:
+            runner = self.actionRunner
+            runner.lock.acquire()
+            self.currentTestRunner = TestRunner(test, appRunner, self.diag, runner.exited, runner.killSignal)
+            runner.lock.release()
+
+            if len(runner.workers) == 1:
+                self.currentTestRunner.performActions(self.previousTestRunner)
+                self.previousTestRunner = self.currentTestRunner
+            else:
+                # Other workers may be running tests in the same suites, so they share the suite set up
+                runner.sharedSuites.setUpSuites(self.currentTestRunner)
+                self.currentTestRunner.performTestActions()
+                runner.sharedSuites.tearDownSuites(self.currentTestRunner)
+
+            runner.lock.acquire()
+            self.currentTestRunner = None
+            runner.notifyComplete(test)
+            runner.lock.release()
+
+
+class SharedSuiteSetUp:
+    """ Suite set up and tear down for workers running tests in parallel. Each suite is set up once, by whichever
+    worker first runs a test in it, before any of its tests run. It is torn down once every test added in it has
+    finished, by the actions that set it up """
+    def __init__(self, lock, diag):
+        self.condition = Condition(lock)
+        self.diag = diag
+        self.pendingTests = {}
+        self.setUpRunners = {}
+        self.suitesBeingSetUp = set()
+
+    @staticmethod
+    def getSuites(test):
+        # Innermost suite first
+        suites = []
+        suite = test.parent
+        while suite is not None:
+            suites.append(suite)
+            suite = suite.parent
+        return suites
+
+    def addTest(self, test):
+        with self.condition:
+            for suite in self.getSuites(test):
+                self.pendingTests[suite] = self.pendingTests.get(suite, 0) + 1
+
+    def setUpSuites(self, testRunner):
+        for suite in reversed(self.getSuites(testRunner.test)):
+            with self.condition:
+                while suite in self.suitesBeingSetUp:
+                    self.condition.wait()
+                if suite in self.setUpRunners:
+                    continue
+                self.suitesBeingSetUp.add(suite)
+            self.diag.info("Setting up " + repr(suite) + " for all workers")
+            try:
+                testRunner.handleExceptions(testRunner.appRunner.setUpSuiteForAllActions, suite)
+            finally:
+                with self.condition:
+                    self.suitesBeingSetUp.discard(suite)
+                    self.setUpRunners[suite] = testRunner.appRunner
+                    self.condition.notify_all()
+
+    def tearDownSuites(self, testRunner):
+        toTearDown = []
+        with self.condition:
+            for suite in self.getSuites(testRunner.test):
+                pending = self.pendingTests.get(suite, 0) - 1
+                if pending > 0:
+                    self.pendingTests[suite] = pending
+                else:
+                    self.pendingTests.pop(suite, None)
+                    appRunner = self.setUpRunners.pop(suite, None)
+                    if appRunner:
+                        toTearDown.append((suite, appRunner))
+        for suite, appRunner in toTearDown:
+            testRunner.handleExceptions(appRunner.tearDownSuite, suite)
 
 
 class ActionsCompleteAction(plugins.Action):
@@ -231,7 +364,7 @@ class ApplicationRunner:
         if test.parent:
             self.setUpSuites(action, test.parent)
         if test.classId() == "test-suite":
-            if action in self.suitesToSetUp[test]:
+            if action in self.suitesToSetUp.get(test, []):
                 self.setUpSuite(action, test)
                 self.suitesToSetUp[test].remove(action)
 
@@ -243,6 +376,10 @@ class ApplicationRunner:
         else:
             self.suitesSetUp[suite] = [action]
 
+    def setUpSuiteForAllActions(self, suite):
+        for action in self.actionSequence:
+            self.setUpSuite(action, suite)
+
     def tearDownSuite(self, suite):
         self.diag.info("Try tear down " + repr(suite))
         actionsToTearDown = self.suitesSetUp.get(suite, [])
@@ -314,6 +451,9 @@ class TestRunner:
             self.handleExceptions(previousTestRunner.appRunner.tearDownSuite, suite)
         for suite in setUpSuites:
             self.appRunner.markForSetUp(suite)
+        self.performTestActions()
+
+    def performTestActions(self):
         abandon = self.test.state.shouldAbandon()
         while len(self.actionSequence):
             action = self.actionSequence.pop(0)
@@ -10,12 +10,14 @@ import re
 import tarfile
 import stat
 from texttestlib.default.batch import testoverview
+from texttestlib.default.performance import addToPerformanceHistory
 from texttestlib import plugins
 from .summarypages import GenerateSummaryPage, GenerateGraphs  # only so they become package level entities
 from collections import OrderedDict
-from .batchutils import getBatchRunName, BatchVersionFilter, parseFileName, convertToUrl
+from .batchutils import getBatchRunName, BatchVersionFilter, parseFileName, convertToUrl, ResultIndex
 import subprocess
 from glob import glob
+from threading import Lock
 
 
 class BatchCategory(plugins.Filter):
@@ -488,6 +490,8 @@ class SaveState(plugins.Responder):
         self.failureFileName = "teststate_" + self.runPostfix
         self.successFileName = "succeeded_runs"
         self.repositories = {}
+        self.resultIndices = {}
+        self.indexLock = Lock()
         self.allApps = allApps
         self.diag = logging.getLogger("Save Repository")
         self.checkRunNameValid()
@@ -514,9 +518,10 @@ class SaveState(plugins.Responder):
                 self.diag.info("No repositories for " + repr(test.app) + " in " + repr(self.repositories))
 
     def saveToRepository(self, test):
+        addToPerformanceHistory(test, self.runPostfix)
         testRepository = self.repositories[test.app]
-        targetDir = os.path.join(testRepository, test.app.name, getVersionName(test.app, self.allApps),
-                                 test.getRelPath())
+        versionDir = os.path.join(testRepository, test.app.name, getVersionName(test.app, self.allApps))
+        targetDir = os.path.join(versionDir, test.getRelPath())
         try:
             plugins.ensureDirectoryExists(targetDir)
         except EnvironmentError:
@@ -535,6 +540,16 @@ class SaveState(plugins.Responder):
                     shutil.copyfile(test.getStateFile(), targetFile)
                 except EnvironmentError:
                     plugins.printWarning("Could not write file at " + targetFile)
+                    return
+        self.updateResultIndex(versionDir, targetFile)
+
+    def updateResultIndex(self, versionDir, targetFile):
+        # So the report generation doesn't need to read the file again
+        with self.indexLock:
+            index = self.resultIndices.get(versionDir)
+            if index is None:
+                index = self.resultIndices[versionDir] = ResultIndex(versionDir, testoverview.GenerateWebPages.summariseStateFile)
+            index.updateFile(targetFile)
 
     def addSuite(self, suite):
         testStateRepository = getBatchRepository(suite)
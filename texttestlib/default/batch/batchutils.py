@@ -1,6 +1,7 @@
 import datetime
 import time
 import os
+import sqlite3
 from texttestlib import plugins
 
 
@@ -76,3 +77,119 @@ def convertToUrl(path, fileMapping):
         if path.startswith(filePath):
             return path.replace(filePath, httpPath)
     return "file://" + os.path.abspath(path)
+
+
+def isResultFile(fileName):
+    return fileName.startswith("teststate_") or fileName.startswith("succeeded_")
+
+
+class ResultIndex:
+    """ Index of the results under a directory of the batch result repository, kept in a database in that
+    directory. It holds what the report needs from each run rather than the files themselves, so generating
+    the report doesn't need to read and unpickle thousands of files. Files are only read again if their size or
+    modification time has changed since they were last indexed, usually because SaveState has just indexed them """
+    fileName = "result_index.db"
+    schemaVersion = 3
+
+    def __init__(self, dirName, summariseStateFile):
+        self.dirName = dirName
+        self.summariseStateFile = summariseStateFile
+        self.connection = self.connect(os.path.join(dirName, self.fileName))
+
+    def connect(self, path):
+        try:
+            connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self.createTables(connection)
+        except sqlite3.Error:
+            # Probably we can't write in the repository. Everything still works, but nothing is kept for next time
+            connection = sqlite3.connect(":memory:", check_same_thread=False)
+            self.createTables(connection)
+        return connection
+
+    def createTables(self, connection):
+        with connection:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != self.schemaVersion:
+                for table in ["files", "dirs", "results"]:  # dirs is from an earlier version
+                    connection.execute("DROP TABLE IF EXISTS " + table)
+                connection.execute("PRAGMA user_version = " + str(self.schemaVersion))
+            connection.execute("CREATE TABLE IF NOT EXISTS files (dir TEXT, file TEXT, mtime INTEGER, size INTEGER, PRIMARY KEY (dir, file))")
+            # One row per run: the summary is the state's details for teststate files, the line for succeeded files
+            connection.execute("CREATE TABLE IF NOT EXISTS results (dir TEXT, file TEXT, line INTEGER, tag TEXT, summary TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS resultfiles ON results (dir, file)")
+
+    def close(self):
+        self.connection.close()
+
+    def getPath(self, dirKey, file):
+        dirName = self.dirName if dirKey == "." else os.path.join(self.dirName, dirKey)
+        return os.path.join(dirName, file)
+
+    def update(self):
+        """ Bring the index up to date with the result files in the repository """
+        try:
+            with self.connection:
+                self.updateFiles()
+        except sqlite3.Error as e:
+            plugins.printWarning("Could not update result index in " + self.dirName + " : " + str(e))
+            self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+            self.createTables(self.connection)
+            with self.connection:
+                self.updateFiles()
+
+    def updateFiles(self):
+        indexedFiles = {(dirKey, file): (mtime, size) for dirKey, file, mtime, size in
+                        self.connection.execute("SELECT dir, file, mtime, size FROM files")}
+        dirsToCheck = [self.dirName]
+        while dirsToCheck:
+            dirName = dirsToCheck.pop()
+            try:
+                entries = list(os.scandir(dirName))
+            except OSError:
+                continue
+            dirKey = os.path.relpath(dirName, self.dirName)
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirsToCheck.append(entry.path)
+                elif isResultFile(entry.name) and entry.is_file():
+                    statInfo = entry.stat()
+                    if indexedFiles.pop((dirKey, entry.name), None) != (statInfo.st_mtime_ns, statInfo.st_size):
+                        self.indexFile(dirKey, entry.name, statInfo)
+        for dirKey, file in indexedFiles:
+            self.removeFile(dirKey, file)
+
+    def indexFile(self, dirKey, file, statInfo):
+        self.connection.execute("DELETE FROM results WHERE dir = ? AND file = ?", (dirKey, file))
+        path = self.getPath(dirKey, file)
+        if file.startswith("teststate_"):
+            rows = [(dirKey, file, 0, file.replace("teststate_", ""), self.summariseStateFile(path))]
+        else:
+            with open(path) as f:
+                rows = [(dirKey, file, lineNo, line.split()[0], line.strip())
+                        for lineNo, line in enumerate(f) if line.split()]
+        self.connection.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?)", rows)
+        self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                (dirKey, file, statInfo.st_mtime_ns, statInfo.st_size))
+
+    def removeFile(self, dirKey, file):
+        for table in ["files", "results"]:
+            self.connection.execute("DELETE FROM " + table + " WHERE dir = ? AND file = ?", (dirKey, file))
+
+    def updateFile(self, path):
+        """ Update the index for a result file that has just been written, changed or removed """
+        dirKey = os.path.relpath(os.path.dirname(path), self.dirName)
+        file = os.path.basename(path)
+        try:
+            with self.connection:
+                try:
+                    self.indexFile(dirKey, file, os.stat(path))
+                except FileNotFoundError:
+                    self.removeFile(dirKey, file)
+        except (sqlite3.Error, EnvironmentError) as e:
+            plugins.printWarning("Could not update result index in " + self.dirName + " for " + path + " : " + str(e))
+
+    def getResults(self):
+        """ All runs in the index, as (path, tag, summary), in the order the files were found in before there
+        was an index. Summaries are as returned by summariseStateFile for teststate files, and the line of
+        the file for succeeded files """
+        rows = self.connection.execute("SELECT dir, file, tag, summary FROM results ORDER BY dir, file, line")
+        return [(self.getPath(dirKey, file), tag, summary) for dirKey, file, tag, summary in rows]
@@ -7,13 +7,14 @@ import html
 import sys
 import logging
 import locale
+import json
 from texttestlib.default.batch import HTMLgen, HTMLcolors, jenkinschanges
 from texttestlib import plugins
 from collections import OrderedDict
 from glob import glob
 from pprint import pformat
 from datetime import datetime, timedelta
-from .batchutils import convertToUrl, getEnvironmentFromRunFiles
+from .batchutils import convertToUrl, getEnvironmentFromRunFiles, ResultIndex
 HTMLgen.PRINTECHO = 0
 
 
@@ -97,6 +98,7 @@ class GenerateWebPages(object):
         self.getConfigValue = getConfigValue
         self.resourceNames = resourceNames
         self.descriptionInfo = descriptionInfo
+        self.resultIndices = {}
         self.diag = logging.getLogger("GenerateWebPages")
 
     def makeSelectors(self, subPageNames, tags=[]):
@@ -116,6 +118,7 @@ class GenerateWebPages(object):
             for fn in tagData.get(tag):
                 if os.path.basename(fn).startswith("teststate_"):
                     os.remove(fn)
+                    self.resultIndices[fn].updateFile(fn)
                 else:
                     successTags.setdefault(fn, []).append(tag)
         for fn, tagsToRemove in list(successTags.items()):
@@ -129,6 +132,7 @@ class GenerateWebPages(object):
             with open(fn, "w") as writeFile:
                 for line in linesToKeep:
                     writeFile.write(line)
+            self.resultIndices[fn].updateFile(fn)
 
     def generate(self, repositoryDirs, subPageNames, archiveUnused):
         minorVersionHeader = HTMLgen.Container()
@@ -174,11 +178,10 @@ class GenerateWebPages(object):
                 categoryHandlers = {}
                 self.diag.info("Processing " + str(len(stateFiles)) + " teststate files")
                 relevantFiles = 0
-                for stateFile, repository in stateFiles:
-                    tag = self.getTagFromFile(stateFile)
+                for stateFile, repository, tag, summary in stateFiles:
                     if len(tags) == 0 or tag in tags:
                         relevantFiles += 1
-                        testId, state, extraVersion = self.processTestStateFile(stateFile, repository)
+                        testId, state, extraVersion = self.processTestStateFile(stateFile, repository, summary)
                         loggedTests.setdefault(extraVersion, OrderedDict()).setdefault(
                             testId, OrderedDict())[tag] = state
                         categoryHandlers.setdefault(tag, CategoryHandler()).registerInCategory(
@@ -187,28 +190,27 @@ class GenerateWebPages(object):
                             self.diag.info("- Processed " + str(relevantFiles) + " files with matching tags so far")
                 self.diag.info("Processed " + str(relevantFiles) + " relevant teststate files")
                 self.diag.info("Processing " + str(len(successFiles)) + " success files")
-                for successFile, repository in successFiles:
+                for successFile, repository, lines in successFiles:
                     testId = self.getTestIdentifier(successFile, repository)
                     extraVersion = self.findExtraVersion(repository)
-                    with open(successFile) as f:
-                        fileTags = set()
-                        for line in f:
-                            parts = line.strip().split(" ", 1)
-                            if len(parts) != 2:
-                                continue
-                            tag, text = parts
-                            if tag in fileTags:
-                                sys.stderr.write("WARNING: more than one result present for tag '" +
-                                                 tag + "' in file " + successFile + "!\n")
-                                sys.stderr.write("Ignoring later ones\n")
-                                continue
-
-                            fileTags.add(tag)
-                            if len(tags) == 0 or tag in tags:
-                                loggedTests.setdefault(extraVersion, OrderedDict()).setdefault(
-                                    testId, OrderedDict())[tag] = text
-                                categoryHandlers.setdefault(tag, CategoryHandler()).registerInCategory(
-                                    testId, "success", extraVersion, text)
+                    fileTags = set()
+                    for line in lines:
+                        parts = line.split(" ", 1)
+                        if len(parts) != 2:
+                            continue
+                        tag, text = parts
+                        if tag in fileTags:
+                            sys.stderr.write("WARNING: more than one result present for tag '" +
+                                             tag + "' in file " + successFile + "!\n")
+                            sys.stderr.write("Ignoring later ones\n")
+                            continue
+
+                        fileTags.add(tag)
+                        if len(tags) == 0 or tag in tags:
+                            loggedTests.setdefault(extraVersion, OrderedDict()).setdefault(
+                                testId, OrderedDict())[tag] = text
+                            categoryHandlers.setdefault(tag, CategoryHandler()).registerInCategory(
+                                testId, "success", extraVersion, text)
                 self.diag.info("Processed " + str(len(successFiles)) + " success files")
                 versionToShow = self.removePageVersion(version)
                 hasData = False
@@ -273,6 +275,9 @@ class GenerateWebPages(object):
                 page.prepend(HTMLgen.BR())
                 page.script = self.getFilterScripts(pageColours)
 
+        for index in set(self.resultIndices.values()):
+            index.close()
+        self.resultIndices = {}
         self.writePages()
 
     def getFilterScripts(self, pageColours):
@@ -310,28 +315,24 @@ class GenerateWebPages(object):
         tagData, stateFiles, successFiles = {}, [], []
         for _, dir in repositoryDirs:
             self.diag.info("Looking for teststate files in " + dir)
-            for root, _, files in sorted(os.walk(dir)):
-                for file in files:
-                    path = os.path.join(root, file)
-                    if file.startswith("teststate_"):
-                        tag = self.getTagFromFile(file)
-                        stateFiles.append((path, dir))
-                        tagData.setdefault(tag, []).append(path)
-                    elif file.startswith("succeeded_"):
-                        successFiles.append((path, dir))
-                        with open(path) as f:
-                            for line in f:
-                                parts = line.split()
-                                if parts:
-                                    tag = parts[0]
-                                    tagData.setdefault(tag, []).append(path)
+            index = ResultIndex(dir, self.summariseStateFile)
+            index.update()
+            for path, tag, summary in index.getResults():
+                self.resultIndices[path] = index
+                tagData.setdefault(tag, []).append(path)
+                if os.path.basename(path).startswith("teststate_"):
+                    stateFiles.append((path, dir, tag, summary))
+                elif successFiles and successFiles[-1][0] == path:
+                    successFiles[-1][2].append(summary)
+                else:
+                    successFiles.append((path, dir, [summary]))
 
             self.diag.info("Found " + str(len(stateFiles)) + " teststate files and " +
                            str(len(successFiles)) + " success files in " + dir)
         return tagData, stateFiles, successFiles
 
-    def processTestStateFile(self, stateFile, repository):
-        state = self.readState(stateFile)
+    def processTestStateFile(self, stateFile, repository, summary):
+        state = IndexedState(json.loads(summary))
         testId = self.getTestIdentifier(stateFile, repository)
         extraVersion = self.findExtraVersion(repository)
         return testId, state, extraVersion
@@ -359,6 +360,35 @@ class GenerateWebPages(object):
             else:
                 return plugins.Unrunnable("Results file was empty, probably the disk it resides on is full.", "Disk full?")
 
+    @classmethod
+    def summariseStateFile(cls, stateFile):
+        """ What the report needs from a teststate file, for the result index """
+        state = cls.readState(stateFile)
+        summary = {"category": state.category,
+                   "briefText": state.briefText,
+                   "freeText": state.freeText,
+                   "executionHosts": state.executionHosts,
+                   "typeBreakdown": state.getTypeBreakdown()[1] if state.category != "success" else None,
+                   "description": repr(state)}
+        if hasattr(state, "findComparison"):
+            comparisons = state.changedResults + state.newResults + state.missingResults
+            worstComparison = state.getMostSevereFileComparison()
+            summary["comparisons"] = [cls.summariseComparison(comp) for comp in comparisons] + \
+                [cls.summariseComparison(comp, correct=True) for comp in state.correctResults]
+            summary["worstComparison"] = cls.summariseComparison(worstComparison) if worstComparison else None
+        return json.dumps(summary)
+
+    @staticmethod
+    def summariseComparison(comparison, correct=False):
+        perfComparison = getattr(comparison, "perfComparison", None)
+        success = comparison.hasSucceeded()
+        return {"stem": comparison.stem,
+                "correct": correct,
+                "success": success,
+                "type": comparison.getType() if not success else None,
+                "summary": comparison.getSummary(),
+                "percentageChange": perfComparison.percentageChange if perfComparison else None}
+
     @staticmethod
     def readErrorState(errMsg):
         freeText = "Failed to read results file, possibly deprecated format. " + errMsg
@@ -466,6 +496,55 @@ class GenerateWebPages(object):
         return time.mktime(time.strptime(timePart, "%d%b%Y"))
 
 
+class IndexedState:
+    """ The parts of a test state from the batch repository that the report uses, as stored in the result index """
+
+    def __init__(self, summary):
+        self.category = summary["category"]
+        self.briefText = summary["briefText"]
+        self.freeText = summary["freeText"]
+        self.executionHosts = summary["executionHosts"]
+        self.typeBreakdown = summary["typeBreakdown"]
+        self.description = summary["description"]
+        self.comparisons = [IndexedComparison(comp) for comp in summary.get("comparisons", [])]
+        worstComparison = summary.get("worstComparison")
+        self.worstComparison = IndexedComparison(worstComparison) if worstComparison else None
+
+    def __repr__(self):
+        return self.description
+
+    def getTypeBreakdown(self):
+        return self.category, self.typeBreakdown
+
+    def getMostSevereFileComparison(self):
+        return self.worstComparison
+
+    def findComparison(self, stem, includeSuccess=False):
+        for comparison in self.comparisons:
+            if comparison.stem == stem and (includeSuccess or not comparison.correct):
+                return comparison, None
+        return None, None
+
+
+class IndexedComparison:
+    def __init__(self, summary):
+        self.stem = summary["stem"]
+        self.correct = summary["correct"]
+        self.success = summary["success"]
+        self.type = summary["type"]
+        self.summary = summary["summary"]
+        self.percentageChange = summary["percentageChange"]
+
+    def hasSucceeded(self):
+        return self.success
+
+    def getType(self):
+        return self.type
+
+    def getSummary(self):
+        return self.summary
+
+
 class TestTable:
     def __init__(self, getConfigValue, resourceNames, descriptionInfo, tags, categoryHandlers, pageVersion, version, graphFilePath):
         self.getConfigValue = getConfigValue
@@ -752,7 +831,7 @@ class TestTable:
         return self.colourFinder.find(fgcolKey + "_fg"), self.colourFinder.find(bgcolKey + "_bg")
 
     def getPercent(self, fileComp):
-        return fileComp.perfComparison.percentageChange
+        return fileComp.percentageChange
 
     def findTagColour(self, tag):
         return self.colourFinder.find("run_" + getWeekDay(tag) + "_fg")
@@ -6,6 +6,7 @@ import subprocess
 import logging
 import re
 from texttestlib import plugins
+from texttestlib.default import textdiff
 from shutil import copyfile
 
 from fnmatch import fnmatch
@@ -297,6 +298,11 @@ class FileComparison:
         elif self.missingResult():
             return self.previewGenerator.getPreview(open(self.stdCmpFile, errors="ignore"))
 
+        if self.textDiffTool == textdiff.builtinToolName:
+            # Computed in-process, stopping when we have enough for the preview, so file size doesn't matter
+            diffLines = textdiff.getDiffLines(self.stdCmpFile, self.tmpCmpFile, self.previewGenerator.maxLength)
+            return self.previewGenerator.getPreviewFromLines(diffLines)
+
         try:
             stdFileSize = os.path.getsize(self.stdCmpFile)
             tmpFileSize = os.path.getsize(self.tmpCmpFile)
@@ -321,7 +321,10 @@ class TestComparison(BaseTestComparison):
         return ",".join(baseNames)
 
     def getPerformanceStems(self, test):
-        return ["performance"] + list(test.getConfigValue("performance_logfile_extractor").keys())
+        stems = ["performance"] + list(test.getConfigValue("performance_logfile_extractor").keys())
+        if test.getConfigValue("measure_memory_usage") != "false" and "memory" not in stems:
+            stems.append("memory")
+        return stems
 
     def createFileComparison(self, test, stem, standardFile, tmpFile):
         if stem in self.getPerformanceStems(test):
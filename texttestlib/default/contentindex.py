@@ -0,0 +1,128 @@
+""" Index of the contents of approved files, so that selecting tests by file contents (the -grep option)
+doesn't need to read every file. For each file, a signature of the sequences of three letters or digits in it
+is kept in a database, along with the file's size and modification time. Files whose signature shows they cannot
+contain the text are rejected without being read, and everything else is searched as before """
+
+import os
+import atexit
+import logging
+import re
+import sqlite3
+import zlib
+from threading import Lock
+from texttestlib import plugins
+
+# Signatures have 8 bits per distinct sequence in the file, within these limits
+_minSignatureBits = 64
+_maxSignatureBits = 2 ** 18
+# How many new signatures to collect before writing them to the database
+_maxUnsavedEntries = 200
+_wordPattern = re.compile(rb"\w{3,}")
+_gramPattern = re.compile(rb"(?=(\w\w\w))")
+
+
+def getGramHashes(data):
+    # Sequences containing anything other than letters, digits and underscores are left out.
+    # That makes the index much quicker to build, and there are still plenty left to look up
+    return {zlib.crc32(gram) for gram in _gramPattern.findall(data)}
+
+
+def makeSignature(data):
+    # All the sequences are inside words, so each different word only needs looking at once
+    words = set(_wordPattern.findall(data))
+    hashes = getGramHashes(b" ".join(words))
+    bits = _minSignatureBits
+    while bits < len(hashes) * 8 and bits < _maxSignatureBits:
+        bits *= 2
+    signature = bytearray(bits // 8)
+    for gramHash in hashes:
+        bit = gramHash & (bits - 1)
+        signature[bit >> 3] |= 1 << (bit & 7)
+    return bytes(signature)
+
+
+def signatureHasAll(signature, gramHashes):
+    bits = len(signature) * 8
+    for gramHash in gramHashes:
+        bit = gramHash & (bits - 1)
+        if not signature[bit >> 3] & (1 << (bit & 7)):
+            return False
+    return True
+
+
+class ContentIndex:
+    """ Signatures of file contents, kept in a database. Entries are only recomputed when a file's size or
+    modification time has changed. Entries for files that no longer exist are never used, and are left alone """
+    allIndices = {}
+    allIndicesLock = Lock()
+
+    @classmethod
+    def get(cls, indexFile):
+        with cls.allIndicesLock:
+            if indexFile not in cls.allIndices:
+                cls.allIndices[indexFile] = cls(indexFile)
+            return cls.allIndices[indexFile]
+
+    def __init__(self, indexFile):
+        self.diag = logging.getLogger("Content Index")
+        self.lock = Lock()
+        self.unsavedEntries = {}
+        self.connection = self.connect(indexFile)
+        atexit.register(self.save)
+
+    def connect(self, indexFile):
+        try:
+            plugins.ensureDirExistsForFile(indexFile)
+            connection = sqlite3.connect(indexFile, timeout=60, check_same_thread=False)
+            connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, signature BLOB)")
+            return connection
+        except (sqlite3.Error, EnvironmentError) as e:
+            plugins.printWarning("Could not open content index at " + indexFile + " : " + str(e) +
+                                 "\nSearching file contents without it.")
+
+    def save(self):
+        with self.lock:
+            if self.connection is None or not self.unsavedEntries:
+                return
+            try:
+                with self.connection:
+                    rows = [(path,) + entry for path, entry in self.unsavedEntries.items()]
+                    self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                self.diag.info("Failed to save content index : " + str(e))
+            self.unsavedEntries = {}
+
+    def getSignature(self, path):
+        statInfo = os.stat(path)
+        with self.lock:
+            row = self.unsavedEntries.get(path)
+            if row is None:
+                row = self.connection.execute("SELECT mtime, size, signature FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and tuple(row[:2]) == (statInfo.st_mtime_ns, statInfo.st_size):
+            return row[2]
+
+        self.diag.info("Indexing contents of " + path)
+        signature = makeSignature(self.readForIndex(path))
+        with self.lock:
+            self.unsavedEntries[path] = statInfo.st_mtime_ns, statInfo.st_size, signature
+            saveNow = len(self.unsavedEntries) >= _maxUnsavedEntries
+        if saveNow:
+            self.save()
+        return signature
+
+    @staticmethod
+    def readForIndex(path):
+        # Read as GrepFilter does, so the index describes the text it searches
+        with open(path, errors="ignore") as f:
+            return f.read().encode("utf-8", errors="ignore")
+
+    def mightContainAny(self, path, gramHashLists):
+        """ False if the file certainly doesn't contain any text with all of one list of sequences in it """
+        if self.connection is None:
+            return True
+        try:
+            signature = self.getSignature(path)
+            return any(signatureHasAll(signature, gramHashes) for gramHashes in gramHashLists)
+        except (sqlite3.Error, EnvironmentError) as e:
+            self.diag.info("Not using content index for " + path + " : " + str(e))
+            return True
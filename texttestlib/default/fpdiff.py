@@ -1,5 +1,13 @@
 import sys
+import re
 import difflib
+# numpy is imported the first time it's needed, it takes a while and most runs never compare floating point
+numpy = None
+
+# Maximal runs of the characters _getNumberAt considers part of a number
+_numberRunRegex = re.compile("([0-9.eE+-]+)")
+# How many lines to compare in one go
+_batchSize = 10000
 
 
 def _getNumberAt(l, pos):
@@ -65,22 +73,124 @@ def _fpequal(l1, l2, tolerance, relTolerance):
         return _fpequalAtPos(l1, l2, tolerance, relTolerance, pos)[0]
 
 
+def _tokenise(l):
+    # Alternately text and possible numbers, so the odd entries are the numbers
+    return _numberRunRegex.split(l)
+
+
+def _isWholeNumber(run):
+    # Runs like this are always read in their entirety by _getNumberAt
+    return run.count(".") <= 1 and run.count("e") + run.count("E") <= 1
+
+
+def _getNumberPairs(l1, l2):
+    # Returns the pairs of numbers that must match for the lines to be considered equal,
+    # None if they can't be compared by token, or False if they are clearly different
+    tokens1, tokens2 = _tokenise(l1), _tokenise(l2)
+    if len(tokens1) != len(tokens2) or tokens1[::2] != tokens2[::2]:
+        return
+    pairs = []
+    for run1, run2 in zip(tokens1[1::2], tokens2[1::2]):
+        if run1 != run2:
+            if not _isWholeNumber(run1) or not _isWholeNumber(run2):
+                return
+            try:
+                pairs.append((float(run1), float(run2)))
+            except ValueError:
+                return False
+    return pairs
+
+
+def _fpequalValues(number1, number2, tolerance, relTolerance):
+    deviation = abs(number1 - number2)
+    if tolerance != None and deviation <= tolerance:
+        return True
+    elif relTolerance != None:
+        referenceValue = abs(number1)
+        if referenceValue == 0:
+            return deviation == 0
+        else:
+            return deviation / referenceValue <= relTolerance
+    return False
+
+
+def _importNumpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+    return numpy
+
+
+def _fpequalArrays(numbers1, numbers2, tolerance, relTolerance):
+    with numpy.errstate(all="ignore"):
+        deviation = numpy.abs(numbers1 - numbers2)
+        equal = numpy.zeros(len(deviation), dtype=bool)
+        if tolerance != None:
+            equal |= deviation <= tolerance
+        if relTolerance != None:
+            referenceValue = numpy.abs(numbers1)
+            relEqual = numpy.where(referenceValue == 0, deviation == 0, deviation / referenceValue <= relTolerance)
+            equal |= relEqual
+    return equal
+
+
+def _fpequalBatch(linePairs, tolerance, relTolerance):
+    # Same answers as calling _fpequal on each pair, but the numbers are compared together
+    results = [None] * len(linePairs)
+    numbers1, numbers2, owners = [], [], []
+    for index, (l1, l2) in enumerate(linePairs):
+        if l1 == l2:
+            results[index] = True
+            continue
+        pairs = _getNumberPairs(l1, l2)
+        if pairs is None:
+            results[index] = _fpequal(l1, l2, tolerance, relTolerance)
+        elif pairs is False:
+            results[index] = False
+        else:
+            results[index] = True
+            for number1, number2 in pairs:
+                numbers1.append(number1)
+                numbers2.append(number2)
+                owners.append(index)
+    if len(owners) > 0 and _importNumpy():
+        equal = _fpequalArrays(numpy.array(numbers1), numpy.array(numbers2), tolerance, relTolerance)
+        for index in numpy.array(owners)[~equal]:
+            results[index] = False
+    else:
+        for number1, number2, index in zip(numbers1, numbers2, owners):
+            if results[index] and not _fpequalValues(number1, number2, tolerance, relTolerance):
+                results[index] = False
+    return results
+
+
+def _writeFiltered(fromlines, tolines, outlines, tolerance, relTolerance):
+    for start in range(0, len(fromlines), _batchSize):
+        linePairs = list(zip(fromlines[start:start + _batchSize], tolines[start:start + _batchSize]))
+        for (fromline, toline), equal in zip(linePairs, _fpequalBatch(linePairs, tolerance, relTolerance)):
+            outlines.write(fromline if equal else toline)
+
+
 def fpfilter(fromlines, tolines, outlines, tolerance, relTolerance=None, useDifflib=False):
     if not useDifflib:
-        for fromline, toline in zip(fromlines, tolines):
-            if fromline == toline or _fpequal(fromline, toline, tolerance, relTolerance):
-                outlines.write(fromline)
-            else:
-                outlines.write(toline)
+        commonLength = min(len(fromlines), len(tolines))
+        _writeFiltered(fromlines[:commonLength], tolines[:commonLength], outlines, tolerance, relTolerance)
         outlines.writelines(tolines[len(fromlines):])
-        return
+    elif fromlines == tolines:
+        outlines.writelines(tolines)
+    else:
+        # Lines can't be matched up any other way first, even ones that look the same apart from their numbers:
+        # it changes how difflib matches the rest, and hence which changes are within the tolerance
+        _fpfilterWithDifflib(fromlines, tolines, outlines, tolerance, relTolerance)
+
+
+def _fpfilterWithDifflib(fromlines, tolines, outlines, tolerance, relTolerance):
     s = difflib.SequenceMatcher(None, fromlines, tolines)
     for tag, i1, i2, j1, j2 in s.get_opcodes():
         if tag == "replace" and i2 - i1 == j2 - j1:
-            for fromline, toline in zip(fromlines[i1:i2], tolines[j1:j2]):
-                if _fpequal(fromline, toline, tolerance, relTolerance):
-                    outlines.write(fromline)
-                else:
-                    outlines.write(toline)
+            _writeFiltered(fromlines[i1:i2], tolines[j1:j2], outlines, tolerance, relTolerance)
         else:
             outlines.writelines(tolines[j1:j2])
@@ -7,6 +7,7 @@ import shutil
 import tempfile
 from gi.repository import Gtk, Gdk, GObject
 from texttestlib import plugins
+from texttestlib.default import textdiff
 from .. import guiplugins, guiutils, entrycompletion
 from ..default_gui import adminactions, changeteststate
 from . import custom_widgets
@@ -771,8 +772,11 @@ class FilteredDiffGUI(GenericDiffGUI):
                 if errors:
                     self.storeResult(fileName, errors, test)
                     continue
-                proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-                output = proc.communicate()[0]
+                if diffProgram == textdiff.builtinToolName:
+                    output = "".join(textdiff.getDiffLines(*args[1:]))
+                else:
+                    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+                    output = proc.communicate()[0]
                 self.storeResult(fileName, output, test)
             shutil.rmtree(tmpDir)
 
@@ -108,6 +108,9 @@ class BugTrigger:
         useRegexp = int(getOption("use_regexp", "1"))
         searchStr = getOption("search_string").replace("\\n", "\n")
         self.textTrigger = plugins.MultilineTextTrigger(searchStr, useRegexp)
+        self.lineTrigger = self.findLineTrigger()
+        self.triggerOnAbsence = getOption("trigger_on_absence", False)
+        self.triggerOnIdentical = getOption("trigger_on_identical", False)
         self.triggerHosts = self.getTriggerHosts(getOption)
         self.checkUnchanged = int(getOption("trigger_on_success", "0"))
         self.reportInternalError = int(getOption("internal_error", "0"))
@@ -119,6 +122,30 @@ class BugTrigger:
     def __repr__(self):
         return repr(self.textTrigger)
 
+    def findLineTrigger(self):
+        # Single-line triggers whose pattern can be combined with others, see FileBugData.prepare.
+        # We match these without changing the MultilineTextTrigger's state, so they can be shared between tests
+        if len(self.textTrigger.triggers) == 1:
+            lineTrigger = self.textTrigger.triggers[0]
+            if lineTrigger.regex is None or (lineTrigger.regex.groups == 0 and lineTrigger.regex.flags == re.U):
+                return lineTrigger
+
+    def getLinePattern(self):
+        if self.lineTrigger.regex is None:
+            return re.escape(self.lineTrigger.text)
+        else:
+            return "(?:" + self.lineTrigger.text + ")"
+
+    def copyForTest(self):
+        # Multi-line matching remembers how far it's got, so each test needs its own trigger
+        if self.lineTrigger:
+            return self
+        newTrigger = copy(self)
+        newTrigger.textTrigger = copy(self.textTrigger)
+        newTrigger.textTrigger.aggregator = plugins.MatchAggregator()
+        newTrigger.textTrigger.reset()
+        return newTrigger
+
     def getTriggerHosts(self, getOption):
         hostStr = getOption("execution_hosts")
         if hostStr:
@@ -137,7 +164,10 @@ class BugTrigger:
             return UnreportedBug(getOption("full_description"), getOption("brief_description"), self.reportInternalError, prioStr, rerunCount, rerunOnly)
 
     def matchesText(self, line):
-        return self.textTrigger.matches(line)
+        if self.lineTrigger:
+            return self.lineTrigger.matches(line)
+        else:
+            return self.textTrigger.matches(line)
 
     def exactMatch(self, lines, **kw):
         updatedLines = [line for i, line in enumerate(lines) if i < len(lines) - 1] if lines[-1] == '' else lines
@@ -163,7 +193,7 @@ class BugTrigger:
         if multipleDiffs and not self.ignoreOtherErrors:
             self.diag.info("Multiple differences present, allowing others through")
             return False
-        if line is not None and not self.textTrigger.matches(line):
+        if line is not None and not self.matchesText(line):
             return False
 
         if self.customTrigger and not self.customTriggerMatches(execHosts, tmpDir):
@@ -210,19 +240,56 @@ class FileBugData:
         self.absentList = []
         self.identicalList = []
         self.checkUnchanged = False
+        self.prepared = False
+        self.lineRegex = None
+        self.otherPresentList = []
+        self.otherAbsentList = []
         self.diag = logging.getLogger("Check For Bugs")
 
     def addBugTrigger(self, getOption):
-        bugTrigger = BugTrigger(getOption)
+        self.addTrigger(BugTrigger(getOption))
+
+    def addTrigger(self, bugTrigger):
+        self.prepared = False
         if bugTrigger.checkUnchanged:
             self.checkUnchanged = True
-        if getOption("trigger_on_absence", False):
+        if bugTrigger.triggerOnAbsence:
             self.absentList.append(bugTrigger)
-        elif getOption("trigger_on_identical", False):
+        elif bugTrigger.triggerOnIdentical:
             self.identicalList.append(bugTrigger)
         else:
             self.presentList.append(bugTrigger)
 
+    def prepare(self):
+        # Combine all the single-line triggers into one regular expression, so that most lines need only one check
+        if self.prepared:
+            return
+        patterns = [bugTrigger.getLinePattern() for bugTrigger in self.presentList + self.absentList if bugTrigger.lineTrigger]
+        try:
+            self.lineRegex = re.compile("|".join(patterns)) if patterns else None
+        except re.error:
+            self.lineRegex = None
+        self.findOtherTriggers()
+        self.prepared = True
+
+    def findOtherTriggers(self):
+        # The triggers that lineRegex doesn't cover, so need checking on every line
+        if self.lineRegex:
+            self.otherPresentList = [bugTrigger for bugTrigger in self.presentList if not bugTrigger.lineTrigger]
+            self.otherAbsentList = [bugTrigger for bugTrigger in self.absentList if not bugTrigger.lineTrigger]
+        else:
+            self.otherPresentList = self.presentList
+            self.otherAbsentList = self.absentList
+
+    def copyForTest(self):
+        self.prepare()
+        newData = copy(self)
+        newData.presentList = [bugTrigger.copyForTest() for bugTrigger in self.presentList]
+        newData.absentList = [bugTrigger.copyForTest() for bugTrigger in self.absentList]
+        newData.identicalList = [bugTrigger.copyForTest() for bugTrigger in self.identicalList]
+        newData.findOtherTriggers()
+        return newData
+
     def findBugs(self, fileName, execHosts, isChanged, multipleDiffs):
         if not self.checkUnchanged and not isChanged:
             self.diag.info("File not changed, ignoring all bugs")
@@ -236,31 +303,33 @@ class FileBugData:
 
         self.diag.info("Looking for bugs in " + fileName)
         dirname = os.path.dirname(fileName)
-        return self.findBugsInText(open(fileName).readlines(), execHosts=execHosts, isChanged=isChanged, multipleDiffs=multipleDiffs, tmpDir=dirname)
+        with open(fileName) as f:
+            lines = f.readlines()
+        return self.findBugsInText(lines, execHosts=execHosts, isChanged=isChanged, multipleDiffs=multipleDiffs, tmpDir=dirname)
 
     def findBugsInText(self, lines, **kw):
-        currAbsent = copy(self.absentList)
+        self.prepare()
+        currAbsent = set(self.absentList)
         bugs = []
         for bugTrigger in self.identicalList:
             if bugTrigger not in bugs and bugTrigger.exactMatch(lines, **kw):
                 bugs.append(bugTrigger)
         for line in lines:
-            self.diag.info("Checking " + repr(line))
-            for bugTrigger in self.presentList:
-                self.diag.info("Checking for existence of " + repr(bugTrigger))
+            if self.lineRegex is None or self.lineRegex.search(line):
+                self.diag.info("Checking " + repr(line))
+                presentList, absentList = self.presentList, self.absentList
+            else:
+                presentList, absentList = self.otherPresentList, self.otherAbsentList
+            for bugTrigger in presentList:
                 if bugTrigger not in bugs and bugTrigger.hasBug(line, **kw):
-                    self.diag.info("FOUND!")
+                    self.diag.info("FOUND " + repr(bugTrigger) + "!")
                     bugs.append(bugTrigger)
-            toRemove = []
-            for bugTrigger in currAbsent:
-                self.diag.info("Checking for absence of " + repr(bugTrigger))
-                if bugTrigger.matchesText(line):
-                    self.diag.info("PRESENT!")
-                    toRemove.append(bugTrigger)
-            for bugTrigger in toRemove:
-                currAbsent.remove(bugTrigger)
+            for bugTrigger in absentList:
+                if bugTrigger in currAbsent and bugTrigger.matchesText(line):
+                    self.diag.info("PRESENT " + repr(bugTrigger) + "!")
+                    currAbsent.remove(bugTrigger)
 
-        return bugs + self.findAbsenceBugs(currAbsent, **kw)
+        return bugs + self.findAbsenceBugs([bugTrigger for bugTrigger in self.absentList if bugTrigger in currAbsent], **kw)
 
     def findAbsenceBugs(self, absentList, **kw):
         bugs = []
@@ -318,10 +387,25 @@ class BugMap(OrderedDict):
             plugins.printWarning("Bug file at " + fileName + " could not be parsed, ignoring\n" + str(e))
 
     def readFromParser(self, parser):
+        self.addTriggers(self.readTriggers(parser))
+
+    @staticmethod
+    def readTriggers(parser):
+        triggers = []
         for section in reversed(sorted(parser.sections())):
             getOption = ParseMethod(parser, section)
-            fileStem = getOption("search_file")
-            self.setdefault(fileStem, FileBugData()).addBugTrigger(getOption)
+            triggers.append((getOption("search_file"), BugTrigger(getOption)))
+        return triggers
+
+    def addTriggers(self, triggers):
+        for fileStem, bugTrigger in triggers:
+            self.setdefault(fileStem, FileBugData()).addTrigger(bugTrigger)
+
+    def copyForTest(self):
+        newMap = BugMap()
+        for fileStem, bugData in list(self.items()):
+            newMap[fileStem] = bugData.copyForTest()
+        return newMap
 
 
 class CheckForCrashes(plugins.Action):
@@ -358,6 +442,11 @@ class CheckForCrashes(plugins.Action):
 
 
 class CheckForBugs(plugins.Action):
+    # Parsing and compiling the bugs is expensive, and the same files apply to many tests.
+    # Cache the triggers from each file, and the combination of files for each test
+    bugFileCache = {}
+    bugMapCache = {}
+
     def __init__(self):
         self.diag = logging.getLogger("Check For Bugs")
 
@@ -477,13 +566,34 @@ class CheckForBugs(plugins.Action):
         return diffCount > 1
 
     def readBugs(self, test):
-        bugMap = BugMap()
         # Mostly for backwards compatibility, reverse the list so that more specific bugs
         # get checked first.
-        for bugFile in reversed(test.getAllPathNames("knownbugs")):
+        fileKeys = tuple(map(self.getBugFileKey, reversed(test.getAllPathNames("knownbugs"))))
+        bugMap = self.bugMapCache.get(fileKeys)
+        if bugMap is None:
+            bugMap = BugMap()
+            for fileKey in fileKeys:
+                bugMap.addTriggers(self.readTriggers(fileKey))
+            self.bugMapCache[fileKeys] = bugMap
+        return bugMap.copyForTest()
+
+    @staticmethod
+    def getBugFileKey(bugFile):
+        try:
+            statInfo = os.stat(bugFile)
+            return bugFile, statInfo.st_mtime_ns, statInfo.st_size
+        except OSError:
+            return bugFile, None, None
+
+    def readTriggers(self, fileKey):
+        triggers = self.bugFileCache.get(fileKey)
+        if triggers is None:
+            bugFile = fileKey[0]
             self.diag.info("Reading bugs from file " + bugFile)
-            bugMap.readFromFile(bugFile)
-        return bugMap
+            parser = BugMap.makeParser(bugFile)
+            triggers = BugMap.readTriggers(parser) if parser else []
+            self.bugFileCache[fileKey] = triggers
+        return triggers
 
     def fixBackupMessage(self, newState):
         newFreeText = ""
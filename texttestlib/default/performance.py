@@ -2,6 +2,7 @@
 import os
 import sys
 import time
+import statistics
 from texttestlib import plugins
 from .comparefile import FileComparison
 
@@ -39,6 +40,42 @@ def getTestPerformance(test, version=None):
         return getTestPerformance(test, version)
 
 
+def getPerformanceHistoryFile(test, stem):
+    historyDir = test.getConfigValue("performance_history_location")
+    if historyDir:
+        version = test.app.getFullVersion() or "default"
+        return os.path.join(os.path.expanduser(historyDir), test.app.name, version, test.getRelPath(), stem + "_history")
+
+
+def readPerformanceHistory(fileName, maxRuns):
+    # One line per run, with the performance last
+    values = []
+    try:
+        with open(fileName) as f:
+            for line in f:
+                try:
+                    values.append(float(line.split()[-1]))
+                except (ValueError, IndexError):
+                    pass
+    except EnvironmentError:
+        pass
+    return values[-maxRuns:]
+
+
+def addToPerformanceHistory(test, runName):
+    for comparison in getattr(test.state, "allResults", []):
+        if isinstance(comparison, PerformanceFileComparison) and comparison.tmpFile and os.path.isfile(comparison.tmpFile):
+            fileName = getPerformanceHistoryFile(test, comparison.stem)
+            perf = getPerformance(comparison.tmpFile)
+            if fileName and perf >= 0:
+                try:
+                    plugins.ensureDirExistsForFile(fileName)
+                    with open(fileName, "a") as f:
+                        f.write(runName + " " + str(perf) + "\n")
+                except EnvironmentError:
+                    plugins.printWarning("Could not write performance history at " + fileName)
+
+
 def describePerformance(fileName):
     line = open(fileName).readline().strip()
     if "mem" in os.path.basename(fileName):
@@ -97,6 +134,9 @@ class PerformanceConfigSettings:
     def flagSet(self, configEntry):
         return self.configMethod(configEntry, self.configName) == "true"
 
+    def getValue(self, configEntry):
+        return self.configMethod(configEntry, self.configName)
+
     def aboveMinimum(self, value, configEntry):
         minimum = self.configMethod(configEntry, self.configName)
         return value < 0 or value > minimum
@@ -155,9 +195,24 @@ class PerformanceFileComparison(FileComparison):
             newPerf = getPerformance(self.tmpFile)
             self.diag.info("Performance is " + str(oldPerf) + " and " + str(newPerf))
             settings = PerformanceConfigSettings(test, self.stem)
-            self.perfComparison = PerformanceComparison(oldPerf, newPerf, settings)
+            history = self.getHistory(test, settings)
+            if history:
+                self.diag.info("Comparing with performance history " + repr(history))
+                self.perfComparison = HistoricalPerformanceComparison(history, newPerf, settings)
+            else:
+                self.perfComparison = PerformanceComparison(oldPerf, newPerf, settings)
             self.differenceCache = self.perfComparison.isSignificant(settings)
 
+    def getHistory(self, test, settings):
+        # Without enough previous runs, we can't say anything about the spread, so compare with the approved file
+        maxRuns = settings.getValue("performance_history_runs")
+        fileName = getPerformanceHistoryFile(test, self.stem)
+        if maxRuns > 0 and fileName:
+            history = readPerformanceHistory(fileName, maxRuns)
+            if len(history) >= min(maxRuns, 3):
+                return history
+        return []
+
     def __repr__(self):
         baseText = FileComparison.__repr__(self)
         if self.newResult():
@@ -249,15 +304,40 @@ class PerformanceComparison:
         if settings.ignoreImprovements() and self.newPerformance < self.oldPerformance:
             return False
 
-        longEnough = settings.aboveMinimum(self.newPerformance, "performance_test_minimum") or \
-            settings.aboveMinimum(self.oldPerformance, "performance_test_minimum")
         varianceEnough = settings.aboveMinimum(self.percentageChange, "performance_variation_%")
-        return longEnough and varianceEnough
+        return self.isLongEnough(settings) and varianceEnough
+
+    def isLongEnough(self, settings):
+        return settings.aboveMinimum(self.newPerformance, "performance_test_minimum") or \
+            settings.aboveMinimum(self.oldPerformance, "performance_test_minimum")
 
     def getAverage(self):
         return round((self.oldPerformance + self.newPerformance) / 2.0, 2)
 
 
+class HistoricalPerformanceComparison(PerformanceComparison):
+    """ Compares a performance number with those from previous runs rather than a single approved number.
+    It's significant if it's further from their median than allowed by performance_history_tolerance, which
+    is a number of standard deviations, estimated from the median absolute deviation. It must also differ by
+    more than performance_variation_% as usual, so that runs which all gave the same figure don't make any
+    change at all significant """
+    # Scales the median absolute deviation to estimate the standard deviation, for normally distributed data
+    madScaleFactor = 1.4826
+
+    def __init__(self, history, newPerf, settings):
+        median = statistics.median(history)
+        deviation = statistics.median([abs(perf - median) for perf in history]) * self.madScaleFactor
+        self.tolerance = settings.getValue("performance_history_tolerance") * deviation
+        PerformanceComparison.__init__(self, median, newPerf, settings)
+
+    def isSignificant(self, settings):
+        if settings.ignoreImprovements() and self.newPerformance < self.oldPerformance:
+            return False
+
+        varianceEnough = settings.aboveMinimum(self.percentageChange, "performance_variation_%")
+        return self.isLongEnough(settings) and varianceEnough and abs(self.newPerformance - self.oldPerformance) > self.tolerance
+
+
 class TimeFilter(plugins.Filter):
     option = "r"
 
@@ -3,9 +3,14 @@
 
 import os
 import logging
+import re
 import shutil
+from collections import deque
+from hashlib import sha1
+from locale import getpreferredencoding
+from threading import Lock, get_ident
 from texttestlib.default import fpdiff
-from texttestlib import plugins
+from texttestlib import plugins, texttest_version
 from optparse import OptionParser
 from io import StringIO
 
@@ -39,22 +44,42 @@ class FilterAction(plugins.Action):
         pass
 
     def performAllFilterings(self, test, stem, fileName, newFileName):
-        currFileName = fileName
         filters = self.makeAllFilters(test, stem, test.app)
-        for fileFilter in filters:
-            writeFileName = newFileName + "." + fileFilter.postfix
-            self.diag.info("Applying " + fileFilter.__class__.__name__ +
-                           " to make\n" + writeFileName + " from\n " + currFileName)
-            if os.path.isfile(writeFileName):
-                self.diag.info("Removing previous file at " + writeFileName)
-                os.remove(writeFileName)
-            currFile = open(currFileName, errors="ignore")
-            writeFile = plugins.openForWrite(writeFileName)
-            fileFilter.filterFile(currFile, writeFile)
-            writeFile.close()
-            currFileName = writeFileName
-        if len(filters) > 0 and currFileName != newFileName:
-            shutil.move(currFileName, newFileName)
+        if len(filters) > 0:
+            self.writeFilteredFile(test, filters, fileName, newFileName)
+
+    def writeFilteredFile(self, test, filters, fileName, newFileName):
+        self.diag.info("Applying " + ",".join(f.__class__.__name__ for f in filters) +
+                       " to make\n" + newFileName + " from\n " + fileName)
+        if os.path.isfile(newFileName):
+            # Don't write through it, it may be linked from the filtered file cache
+            os.remove(newFileName)
+        with open(fileName, errors="ignore") as currFile:
+            with plugins.openForWrite(newFileName) as writeFile:
+                self.applyFilters(filters, currFile, writeFile, newFileName)
+
+    def applyFilters(self, filters, inFile, writeFile, newFileName=None):
+        # All filters run in one pass: each one consumes the lines produced by the one before,
+        # without any intermediate files being written and read back
+        lines = inFile
+        for fileFilter in filters[:-1]:
+            filteredText = fileFilter.iterFilteredText(lines)
+            if newFileName and fileFilter.keepIntermediateFile:
+                filteredText = self.teeToFile(filteredText, newFileName + "." + fileFilter.postfix)
+            lines = iterLines(filteredText)
+        filters[-1].filterFile(lines, writeFile)
+
+    def getIntermediatePostfixes(self, filters):
+        return [f.postfix for f in filters[:-1] if f.keepIntermediateFile]
+
+    def teeToFile(self, textIter, fileName):
+        self.diag.info("Also writing intermediate file at " + fileName)
+        if os.path.isfile(fileName):
+            os.remove(fileName)
+        with plugins.openForWrite(fileName) as writeFile:
+            for text in textIter:
+                writeFile.write(text)
+                yield text
 
     def getAllFilters(self, test, fileName, app):
         stem = self.getStem(fileName)
@@ -62,22 +87,15 @@ class FilterAction(plugins.Action):
 
     def getFilteredText(self, test, fileName, app):
         filters = self.getAllFilters(test, fileName, app)
-        inFile = open(fileName, errors="ignore")
-        if len(filters) == 0:
-            try:
+        with open(fileName, errors="ignore") as inFile:
+            if len(filters) == 0:
                 return inFile.read()
-            finally:
-                inFile.close()
-        for fileFilter in filters:
-            self.diag.info("Applying " + fileFilter.__class__.__name__ + " to " + fileName)
+            self.diag.info("Applying " + ",".join(f.__class__.__name__ for f in filters) + " to " + fileName)
             outFile = StringIO()
-            fileFilter.filterFile(inFile, outFile)
-            inFile.close()
-            inFile = outFile
-            inFile.seek(0)
-        value = outFile.getvalue()
-        outFile.close()
-        return value
+            self.applyFilters(filters, inFile, outFile)
+            value = outFile.getvalue()
+            outFile.close()
+            return value
 
     def makeAllFilters(self, test, stem, app):
         filters = self._makeAllFilters(test, stem, app)
@@ -112,6 +130,17 @@ class FilterOriginal(FilterAction):
         resultFiles, defFiles = test.listApprovedFiles(allVersions=False, defFileCategory="regenerate")
         return self.constantPostfix(resultFiles + defFiles, "origcmp")
 
+    def writeFilteredFile(self, test, filters, fileName, newFileName):
+        cache = FilteredFileCache.forApp(test.app)
+        key = cache.makeKey(fileName, filters) if cache else None
+        postfixes = self.getIntermediatePostfixes(filters)
+        if key and cache.fetch(key, newFileName, postfixes):
+            self.diag.info("Reused cached filtered file for " + fileName)
+            return
+        FilterAction.writeFilteredFile(self, test, filters, fileName, newFileName)
+        if key:
+            cache.store(key, newFileName, postfixes)
+
     def changeToFilteringState(self, test):
         # Notifications of current status are only useful when doing normal filtering in the GUI
         execMachines = test.state.executionHosts
@@ -177,8 +206,140 @@ class FilterResultRecompute(FilterOnTempFile):
         return result
 
 
+class FilteredFileCache:
+    """ Filtered approved files, stored under a hash of their contents and of the filters applied.
+    Approved files rarely change between runs, so this saves filtering them again each time.
+    Entries are hard-linked into the sandbox where possible, and the least recently used
+    are removed once the cache grows beyond its maximum size """
+    instances = {}
+    instanceLock = Lock()
+
+    @classmethod
+    def forApp(cls, app):
+        directory = app.getConfigValue("filtered_file_cache")
+        if not directory:
+            return
+        maxBytes = int(app.getConfigValue("filtered_file_cache_max_size")) * 1024 * 1024
+        with cls.instanceLock:
+            if directory not in cls.instances:
+                cls.instances[directory] = cls(directory, maxBytes)
+            return cls.instances[directory]
+
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.currentSize = None
+        self.lock = Lock()
+        self.diag = logging.getLogger("Filtered File Cache")
+
+    def makeKey(self, fileName, filters):
+        filterKeys = [getattr(f, "getCacheKey", lambda: None)() for f in filters]
+        if None in filterKeys:
+            return  # unknown kind of filter, don't know what affects it
+        hash = sha1()
+        # Reading and writing as text depends on the platform and locale too
+        settings = [texttest_version.version, os.name, getpreferredencoding(False)] + filterKeys
+        hash.update(repr(settings).encode())
+        try:
+            with open(fileName, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    hash.update(chunk)
+        except OSError:
+            return
+        return hash.hexdigest()
+
+    def getEntryPath(self, key, postfix=""):
+        entry = os.path.join(self.directory, key[:2], key)
+        return entry + "." + postfix if postfix else entry
+
+    def fetch(self, key, newFileName, postfixes):
+        pairs = [(self.getEntryPath(key), newFileName)]
+        pairs += [(self.getEntryPath(key, postfix), newFileName + "." + postfix) for postfix in postfixes]
+        if not all((os.path.isfile(entry) for entry, _ in pairs)):
+            return False
+        try:
+            for entry, fileName in pairs:
+                # Mark as recently used, which also makes it newer than the approved file
+                os.utime(entry)
+                plugins.ensureDirExistsForFile(fileName)
+                self.linkOrCopy(entry, fileName)
+            self.diag.info("Cache hit for " + newFileName + " at " + pairs[0][0])
+            return True
+        except OSError as e:
+            # Probably evicted by another process in the meantime
+            self.diag.info("Failed to fetch " + key + " from cache : " + str(e))
+            return False
+
+    def store(self, key, newFileName, postfixes):
+        pairs = [(newFileName, self.getEntryPath(key))]
+        pairs += [(newFileName + "." + postfix, self.getEntryPath(key, postfix)) for postfix in postfixes]
+        addedSize = 0
+        try:
+            for fileName, entry in pairs:
+                plugins.ensureDirExistsForFile(entry)
+                # Write under a temporary name first, other processes might be reading the same entry
+                tmpEntry = entry + "." + str(os.getpid()) + "." + str(get_ident()) + ".tmp"
+                self.linkOrCopy(fileName, tmpEntry)
+                os.replace(tmpEntry, entry)
+                addedSize += os.path.getsize(entry)
+        except OSError as e:
+            self.diag.info("Failed to store " + newFileName + " in cache : " + str(e))
+            return
+        self.diag.info("Stored " + newFileName + " in cache at " + pairs[0][1])
+        self.addSize(addedSize)
+
+    def linkOrCopy(self, srcFile, dstFile):
+        if os.path.isfile(dstFile):
+            os.remove(dstFile)
+        try:
+            os.link(srcFile, dstFile)
+        except OSError:
+            # Different file system, or links not supported
+            shutil.copyfile(srcFile, dstFile)
+
+    def addSize(self, addedSize):
+        with self.lock:
+            if self.currentSize is None:
+                self.currentSize = sum((size for _, size, _ in self.findEntries()))
+            else:
+                self.currentSize += addedSize
+            if self.currentSize > self.maxBytes:
+                self.evict()
+
+    def findEntries(self):
+        # An entry is the filtered file plus any intermediate files, they are removed together
+        entries = {}
+        if not os.path.isdir(self.directory):
+            return []
+        for subDir in os.scandir(self.directory):
+            if subDir.is_dir():
+                for dirEntry in os.scandir(subDir.path):
+                    if dirEntry.is_file() and not dirEntry.name.endswith(".tmp"):
+                        stat = dirEntry.stat()
+                        key = dirEntry.name.split(".")[0]
+                        mtime, size, paths = entries.get(key, (0, 0, []))
+                        entries[key] = max(mtime, stat.st_mtime), size + stat.st_size, paths + [dirEntry.path]
+        return list(entries.values())
+
+    def evict(self):
+        entries = self.findEntries()
+        self.currentSize = sum((size for _, size, _ in entries))
+        entries.sort()
+        for _, size, paths in entries:
+            if self.currentSize <= self.maxBytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                    self.diag.info("Evicted " + path + " from cache")
+                except OSError:
+                    pass  # removed by someone else
+            self.currentSize -= size
+
+
 class FloatingPointFilter:
     postfix = "fpdiff"
+    keepIntermediateFile = False
 
     def __init__(self, origFileName, tolerance, relative):
         self.origFileName = origFileName
@@ -190,19 +351,26 @@ class FloatingPointFilter:
 
     def filterFile(self, inFile, writeFile):
         fromlines = open(self.origFileName, errors="ignore").readlines()
-        tolines = inFile.readlines()
+        tolines = list(inFile)
         fpdiff.fpfilter(fromlines, tolines, writeFile, self.tolerance, self.relative)
 
 
 class RunDependentTextFilter(plugins.Observable):
     configKey = "run_dependent_text"
     postfix = "normal"
+    # The "normal" file is viewed in the GUI and saved by save_filtered_file_stems
+    keepIntermediateFile = True
 
     def __init__(self, filterTexts, testId=""):
         plugins.Observable.__init__(self)
         self.diag = logging.getLogger("Run Dependent Text")
         self.lineFilters = [LineFilter(text, testId, self.diag) for text in filterTexts]
 
+    def getCacheKey(self):
+        # The test ID only makes a difference if the filters refer to the write directory
+        return self.__class__.__name__ + repr([(f.originalText, f.testId if f.usesTestId() else "")
+                                               for f in self.lineFilters])
+
     def findRelevantFilters(self, file):
         relevantFilters, sectionFilters = [], []
         for lineFilter in self.lineFilters:
@@ -230,6 +398,9 @@ class RunDependentTextFilter(plugins.Observable):
             if f is lineFilter:
                 return lastLine
 
+    def hasSectionFilters(self):
+        return any((lineFilter.untrigger is not None for lineFilter in self.lineFilters))
+
     def findRelevantSectionFilters(self, sectionFilters, file):
         lineNumber = 0
         matchedFirst, relevantFilters = [], []
@@ -245,30 +416,59 @@ class RunDependentTextFilter(plugins.Observable):
         for sectionFilter in sectionFilters:
             sectionFilter.trigger.reset()
             sectionFilter.untrigger.reset()
-        file.seek(0)
+        if hasattr(file, "seek"):
+            file.seek(0)
         return relevantFilters
 
-    def filterFile(self, file, newFile, filteredAway=None):
+    def filterFile(self, file, newFile):
+        for text in self.iterFilteredText(file):
+            newFile.write(text)
+
+    def iterFilteredText(self, file, filteredAway=None):
+        if not hasattr(file, "seek") and self.hasSectionFilters():
+            file = list(file)  # we need to read it twice, see findRelevantSectionFilters
         lineNumber = 0
-        seekPoints = []
         lineFilters = self.findRelevantFilters(file)
+        prefilter = TriggerPrefilter(lineFilters)
+        # Output is held back only as long as a {PREVLINES} filter might still want to remove it
+        window = deque()
+        windowSize = max([lineFilter.prevLinesToRemove for lineFilter in self.lineFilters] + [0])
+        # We don't want to stack up ActionProgreess calls in ThreaderNotificationHandler ...
+        notifyProgress = len(self.observers) > 0 and self.inMainThread()
         for line in file:
-            # We don't want to stack up ActionProgreess calls in ThreaderNotificationHandler ...
-            self.notifyIfMainThread("ActionProgress")
+            if notifyProgress:
+                self.performNotify("ActionProgress")
             lineNumber += 1
+            if prefilter.unchanged(line, lineNumber):
+                if windowSize:
+                    window.append(line)
+                    if len(window) > windowSize:
+                        yield window.popleft()
+                else:
+                    yield line
+                continue
+
             lineFilter, filteredLine, removeCount = self.getFilteredLine(line, lineNumber, lineFilters)
+            prefilter.update(lineFilters)
             if removeCount:
-                seekPoint = seekPoints[-removeCount - 1]
                 self.diag.info("Removing " + repr(removeCount) + " lines")
-                newFile.seek(seekPoint)
-                newFile.truncate()
-                seekPoints = []
-            if filteredLine:
-                newFile.write(filteredLine)
-            else:
+                for _ in range(min(removeCount, len(window))):
+                    window.pop()
+                # Lines before the ones removed can't be affected any more
+                while window:
+                    yield window.popleft()
+            if not filteredLine:
+                filteredLine = ""
                 if filteredAway is not None and lineFilter is not None:
                     filteredAway.setdefault(lineFilter, []).append(line)
-            seekPoints.append(newFile.tell())
+            if windowSize:
+                window.append(filteredLine)
+                if len(window) > windowSize:
+                    yield window.popleft()
+            elif filteredLine:
+                yield filteredLine
+        while window:
+            yield window.popleft()
 
     def getFilteredLine(self, line, lineNumber, lineFilters):
         appliedLineFilter = None
@@ -299,22 +499,22 @@ class RunDependentTextFilter(plugins.Observable):
 class UnorderedTextFilter(RunDependentTextFilter):
     configKey = "unordered_text"
     postfix = "sorted"
+    keepIntermediateFile = False
 
-    def filterFile(self, file, newFile):
+    def iterFilteredText(self, file):
         unorderedLines = {}
-        RunDependentTextFilter.filterFile(self, file, newFile, unorderedLines)
-        self.writeUnorderedText(newFile, unorderedLines)
+        yield from RunDependentTextFilter.iterFilteredText(self, file, unorderedLines)
+        yield from self.iterUnorderedText(unorderedLines)
 
-    def writeUnorderedText(self, newFile, lines):
+    def iterUnorderedText(self, lines):
         for filter in self.lineFilters:
             unordered = lines.get(filter, [])
             if len(unordered) == 0:
                 continue
             unordered.sort()
-            newFile.write("-- Unordered text as found by filter '" + filter.originalText + "' --" + "\n")
-            for line in unordered:
-                newFile.write(line)
-            newFile.write("\n")
+            yield "-- Unordered text as found by filter '" + filter.originalText + "' --" + "\n"
+            yield from unordered
+            yield "\n"
 
 
 class LineNumberTrigger:
@@ -353,6 +553,71 @@ class MatchNumberTrigger(plugins.TextTrigger):
         self.matchCounter = 0
 
 
+class TriggerPrefilter:
+    """ Decides cheaply whether a line can be passed through unchanged, i.e. no trigger matches it
+    and no filter is in the middle of removing lines. All text triggers are combined into a single
+    regular expression, so most lines of a large file never reach the individual LineFilters """
+
+    def __init__(self, lineFilters):
+        self.combinedRegex = None
+        self.separateRegexes = []
+        self.lineNumbers = set()
+        self.enabled = True
+        patterns = []
+        for lineFilter, _ in lineFilters:
+            trigger = lineFilter.trigger
+            if isinstance(trigger, LineNumberTrigger):
+                self.lineNumbers.add(trigger.lineNumber)
+            elif not isinstance(trigger, plugins.TextTrigger):
+                self.enabled = False  # don't know how to match it without side effects
+            elif trigger.regex is None:
+                patterns.append(re.escape(trigger.text))
+            elif trigger.regex.groups:
+                # Combining would renumber any backreferences
+                self.separateRegexes.append(trigger.regex)
+            else:
+                patterns.append("(?:" + trigger.regex.pattern + ")")
+        if patterns:
+            try:
+                self.combinedRegex = re.compile("|".join(patterns))
+            except re.error:
+                # e.g. inline flags are only allowed at the start of an expression
+                self.separateRegexes += [re.compile(pattern) for pattern in patterns]
+        self.update(lineFilters)
+
+    def update(self, lineFilters):
+        self.active = self.enabled and not any((lineFilter.autoRemove for lineFilter, _ in lineFilters))
+        lastLines = [lastLine for _, lastLine in lineFilters if lastLine is not None]
+        self.lastLineToCheck = min(lastLines) if lastLines else None
+
+    def unchanged(self, line, lineNumber):
+        if not self.active or lineNumber in self.lineNumbers:
+            return False
+        if self.lastLineToCheck is not None and lineNumber >= self.lastLineToCheck:
+            return False  # time to drop a section filter
+        if self.combinedRegex is not None and self.combinedRegex.search(line):
+            return False
+        return not any((regex.search(line) for regex in self.separateRegexes))
+
+
+def iterLines(textIter):
+    # Split generated text into lines in the same way as reading it back from a file would
+    partial = ""
+    for text in textIter:
+        if partial:
+            text = partial + text
+        if text and text.find("\n") == len(text) - 1:
+            partial = ""
+            yield text
+        else:
+            lines = text.split("\n")
+            partial = lines.pop()
+            for line in lines:
+                yield line + "\n"
+    if partial:
+        yield partial
+
+
 def getWriteDirRegexp(testId):
     testId = testId.replace("\\", "/")
     for char in "+^":
@@ -462,6 +727,9 @@ class LineFilter:
         else:
             return plugins.TextTrigger(text)
 
+    def usesTestId(self):
+        return "{INTERNAL " in self.originalText
+
     def isMultiLine(self):
         return self.linesToRemove > 1 or self.prevLinesToRemove > 0 or self.untrigger is not None
 
@@ -9,8 +9,8 @@ import signal
 import pipes
 from texttestlib import plugins
 from texttestlib.jobprocess import killProcessAndChildren
-from time import sleep
-from threading import Lock, Timer
+from time import sleep, monotonic
+from threading import Lock, Timer, Thread, Event
 from locale import getpreferredencoding
 
 plugins.addCategory("killed", "killed", "were terminated before completion")
@@ -41,6 +41,69 @@ class Killed(plugins.TestState):
         self.failedPrediction = self
 
 
+class ResourceMonitor:
+    """ Measures what a test process used by waiting for it with os.wait4, rather than running it under
+    the 'time' program. Can also sample the memory used by all of its child processes while it runs """
+    def __init__(self, process, measureCputime, memoryMode, samplingInterval):
+        self.process = process
+        self.measureCputime = measureCputime
+        self.memoryMode = memoryMode
+        self.startTime = monotonic()
+        self.realTime = None
+        self.resourceUsage = None
+        self.sampledPeakMemory = 0
+        self.samplingStopped = Event()
+        if memoryMode == "tree":
+            Thread(target=self.sampleMemory, args=(samplingInterval,), daemon=True).start()
+
+    def sampleMemory(self, interval):
+        import psutil
+        try:
+            process = psutil.Process(self.process.pid)
+            while not self.samplingStopped.is_set():
+                totalMemory = 0
+                for proc in [process] + process.children(recursive=True):
+                    try:
+                        totalMemory += proc.memory_info().rss
+                    except psutil.Error:
+                        pass  # processes can go away while we're looking at them
+                self.sampledPeakMemory = max(self.sampledPeakMemory, totalMemory)
+                self.samplingStopped.wait(interval)
+        except psutil.Error:
+            pass  # test process has terminated
+
+    def wait(self):
+        try:
+            _, status, self.resourceUsage = plugins.retryOnInterrupt(os.wait4, self.process.pid, 0)
+            self.process.returncode = os.waitstatus_to_exitcode(status)
+        except ChildProcessError:
+            # Already reaped, e.g. when killing it. We can't know how it exited, so do as Popen.wait does
+            self.process.returncode = 0
+        finally:
+            self.samplingStopped.set()
+        self.realTime = monotonic() - self.startTime
+
+    def getPeakMemory(self):
+        # ru_maxrss is in kilobytes, except on Mac OS where it's in bytes
+        peakMemory = self.resourceUsage.ru_maxrss
+        if sys.platform != "darwin":
+            peakMemory *= 1024
+        return max(peakMemory, self.sampledPeakMemory)
+
+    def writeFiles(self, test):
+        if self.resourceUsage is None:
+            return
+        # Same format as 'time -p', so they can be read in the same way
+        if self.measureCputime:
+            with open(test.makeTmpFileName("unixperf", forFramework=1), "w") as f:
+                f.write("real %.2f\n" % self.realTime)
+                f.write("user %.2f\n" % self.resourceUsage.ru_utime)
+                f.write("sys %.2f\n" % self.resourceUsage.ru_stime)
+        if self.memoryMode != "false":
+            with open(test.makeTmpFileName("unixmemory", forFramework=1), "w") as f:
+                f.write("maxrss %.2f\n" % (self.getPeakMemory() / (1024.0 * 1024.0)))
+
+
 class RunTest(plugins.Action):
     def __init__(self):
         self.diag = logging.getLogger("run test")
@@ -99,6 +162,7 @@ class RunTest(plugins.Action):
                 test.notify("TestProcessComplete")
 
             process = self.getTestProcess(test, machine, postfix)
+            resourceMonitor = self.makeResourceMonitor(test, machine, process)
             self.registerProcess(test, process)
             if not postfix:
                 # Don't claim to be running until we are, i.e. the process has started
@@ -106,11 +170,13 @@ class RunTest(plugins.Action):
 
             if killTimeout and not test.app.isRecording() and not test.app.isActionReplay():
                 self.runMultiTimer(killTimeout, self.kill, (test, "timeout"))
-                self.wait(process)
+                self.wait(process, resourceMonitor)
                 self.currentTimer.cancel()
                 self.currentTimer = None
             else:
-                self.wait(process)
+                self.wait(process, resourceMonitor)
+            if resourceMonitor and test not in self.killedTests:
+                resourceMonitor.writeFiles(test)
             self.checkAndClear(test, postfix)
             if self.killSignal is not None:
                 break  # Don't start other processes
@@ -210,9 +276,12 @@ class RunTest(plugins.Action):
         remoteScript = os.path.join(tmpDir, "kill_test.sh")
         test.app.runCommandOn(machine, ["sh", plugins.quote(remoteScript)])
 
-    def wait(self, process):
+    def wait(self, process, resourceMonitor=None):
         try:
-            plugins.retryOnInterrupt(process.wait)
+            if resourceMonitor:
+                resourceMonitor.wait()
+            else:
+                plugins.retryOnInterrupt(process.wait)
         except OSError:  # pragma: no cover - workaround for Python bugs only
             pass  # safest, as there are python bugs in this area
 
@@ -379,9 +448,27 @@ class RunTest(plugins.Action):
             perfFile = test.makeTmpFileName("unixperf", forFramework=1)
         return ["time", "-p", "-o", perfFile]
 
+    def measuresCputime(self, test):
+        return test.app.hasAutomaticCputimeChecking() and test.app.executingOnPerformanceMachine(test)
+
+    def measuresResourcesDirectly(self, machine):
+        # We can only wait for processes on this machine, elsewhere we rely on the 'time' program
+        return machine == "localhost" and hasattr(os, "wait4")
+
+    def makeResourceMonitor(self, test, machine, process):
+        if not self.measuresResourcesDirectly(machine):
+            return
+        measureCputime = self.measuresCputime(test)
+        memoryMode = test.getConfigValue("measure_memory_usage")
+        if memoryMode != "false" and not test.app.executingOnPerformanceMachine(test, "memory"):
+            memoryMode = "false"
+        if measureCputime or memoryMode != "false":
+            self.diag.info("Measuring resource usage of process " + str(process.pid) + ", memory mode " + memoryMode)
+            return ResourceMonitor(process, measureCputime, memoryMode, test.getConfigValue("memory_sampling_interval"))
+
     def getLocalExecuteCmdArgs(self, test, postfix="", makeDirs=True):
         args = []
-        if test.app.hasAutomaticCputimeChecking() and test.app.executingOnPerformanceMachine(test):
+        if self.measuresCputime(test) and not self.measuresResourcesDirectly(test.app.getRunMachine()):
             args += self.getTimingArgs(test, makeDirs)
 
         # Don't expand environment if we're running on a different file system
@@ -13,6 +13,10 @@ from texttestlib.jobprocess import killProcessAndChildren
 from .runtest import Killed
 from collections import OrderedDict
 from string import Template
+from fnmatch import fnmatch
+
+# ioctl request for cloning a file on Linux, from linux/fs.h
+ficloneRequest = 0x40049409
 
 
 def getScriptArgs(script):
@@ -40,6 +44,8 @@ class PrepareWriteDirectory(plugins.Action):
         self.diag = logging.getLogger("Prepare Writedir")
         self.ignoreCatalogues = ignoreCatalogues
         self.handledRequiredPaths = set()
+        # Pairs of source and destination devices where we've found that files can't be cloned, so we don't keep trying
+        self.cloneUnsupportedDevices = set()
         if self.ignoreCatalogues:
             self.diag.info("Ignoring all information in catalogue files")
 
@@ -183,14 +189,22 @@ class PrepareWriteDirectory(plugins.Action):
             except OSError:
                 pass  # If this doesn't work, assume it's on the remote machine and we'll handle it later
 
+        fileCopier = self.getFileCopier(test, target)
         if os.path.isfile(fullPath):
             if os.path.isfile(target):
+                self.unshareFile(target)
                 with open(target, "a") as f:
                     f.write(open(fullPath).read())
             else:
-                self.copyfile(fullPath, target)
+                fileCopier(fullPath, target)
         if os.path.isdir(fullPath):
-            self.copytree(fullPath, target)
+            self.copytree(fullPath, target, fileCopier)
+
+    def getFileCopier(self, test, target):
+        if os.path.basename(target) in test.getConfigValue("copy_test_path_hardlink"):
+            return self.linkfile
+        else:
+            return self.copyfile
 
     def copytimes(self, src, dst):
         if os.path.isdir(src) and os.name == "nt":
@@ -201,9 +215,10 @@ class PrepareWriteDirectory(plugins.Action):
         if hasattr(os, 'utime'):
             os.utime(dst, (st[stat.ST_ATIME], st[stat.ST_MTIME]))
 
-    def copytree(self, src, dst):
+    def copytree(self, src, dst, fileCopier=None):
         # Code is a copy of shutil.copytree, with copying modification times
         # so that we can tell when things change...
+        fileCopier = fileCopier or self.copyfile
         names = os.listdir(src)
         if not os.path.exists(dst):
             os.mkdir(dst)
@@ -216,9 +231,9 @@ class PrepareWriteDirectory(plugins.Action):
                 if os.path.islink(srcname):
                     self.copylink(srcname, dstname)
                 elif os.path.isdir(srcname):
-                    self.copytree(srcname, dstname)
+                    self.copytree(srcname, dstname, fileCopier)
                 else:
-                    self.copyfile(srcname, dstname)
+                    fileCopier(srcname, dstname)
             except (IOError, os.error) as why:
                 print("Can't copy", srcname, "to", dstname, ":", why)
         # Last of all, keep the modification time as it was
@@ -232,9 +247,46 @@ class PrepareWriteDirectory(plugins.Action):
 
     def copyfile(self, srcname, dstname):
         # Basic aim is to keep the permission bits and times where possible, but ensure it is writeable
-        shutil.copy2(srcname, dstname)
+        if self.clonefile(srcname, dstname):
+            shutil.copystat(srcname, dstname)
+        else:
+            shutil.copy2(srcname, dstname)
         plugins.makeWriteable(dstname)
 
+    def clonefile(self, srcname, dstname):
+        # Copy-on-write clone, for file systems that support it (e.g. Btrfs, XFS). Nothing is copied until the test writes
+        if not sys.platform.startswith("linux"):
+            return False
+        import fcntl
+        with open(srcname, "rb") as src, open(dstname, "wb") as dst:
+            # Whether it works depends on both file systems, and whether they're the same one
+            devices = os.fstat(src.fileno()).st_dev, os.fstat(dst.fileno()).st_dev
+            if devices in self.cloneUnsupportedDevices:
+                return False
+            try:
+                fcntl.ioctl(dst.fileno(), ficloneRequest, src.fileno())
+                return True
+            except OSError as e:
+                self.diag.info("Cannot clone files from " + srcname + " to " + dstname + ", copying instead : " + str(e))
+                self.cloneUnsupportedDevices.add(devices)
+                return False
+
+    def linkfile(self, srcname, dstname):
+        # Shares the file with the test data, which the test must not write to. The catalogue will say if it did
+        try:
+            os.link(srcname, dstname)
+        except OSError as e:
+            self.diag.info("Cannot hard link " + srcname + ", copying instead : " + str(e))
+            self.copyfile(srcname, dstname)
+
+    def unshareFile(self, path):
+        # Make sure we don't write to test data via a hard link
+        if os.stat(path).st_nlink > 1:
+            tmpPath = path + ".texttest_unshare"
+            shutil.copy2(path, tmpPath)
+            os.replace(tmpPath, path)
+            plugins.makeWriteable(path)
+
     def linkTestPath(self, test, fullPath, target):
         # Linking doesn't exist on windows!
         if os.name != "posix":
@@ -621,6 +673,7 @@ class TestEnvironmentCreator:
 class CollateFiles(plugins.Action):
     def __init__(self):
         self.filesPresentBefore = {}
+        self.dirListings = {}
         self.collationProc = None
         self.diag = logging.getLogger("Collate Files")
 
@@ -692,6 +745,7 @@ class CollateFiles(plugins.Action):
             self.tryFetchRemoteFiles(test)
             self.collate(test)
             self.removeUnwanted(test)
+        self.clearDirListings(test)
 
     def containsRegexps(self, filePath, regexps):
         with open(filePath) as f:
@@ -741,6 +795,8 @@ class CollateFiles(plugins.Action):
                 collationErrFile = test.makeTmpFileName(targetStem + ".collate_errs", forFramework=1)
                 self.diag.info("Extracting " + ",".join(sourceFiles) + " to " + targetFile)
                 self.extract(test, sourceFiles, targetFile, collationErrFile)
+                # Later patterns might match what we just wrote
+                self.clearDirListings(test)
 
     def tryFetchRemoteFiles(self, test):
         machine, remoteTmpDir = test.app.getRemoteTestTmpDir(test)
@@ -774,8 +830,9 @@ class CollateFiles(plugins.Action):
         return False
 
     def glob(self, test, sourcePattern):
-        # Test name may contain glob meta-characters, and there is no way to quote them (see comment in fnmatch.py)
-        # So we can't just form an absolute path and glob that
+        # Test name may contain glob meta-characters, so we can't just form an absolute path and glob that
+        # The directory is either escaped or not part of the pattern at all, never the current working directory,
+        # so tests can be collated in several threads at once
         localTestDir = test.getDirectory(temporary=1, local=1)
         localFiles = self.globDir(localTestDir, sourcePattern)
         if not localFiles:
@@ -787,11 +844,27 @@ class CollateFiles(plugins.Action):
         return localTestDir, localFiles
 
     def globDir(self, testDir, sourcePattern):
-        origCwd = os.getcwd()
-        os.chdir(testDir)
-        result = glob.glob(sourcePattern)
-        os.chdir(origCwd)
-        return [os.path.join(testDir, f) for f in result]
+        if os.sep in sourcePattern or "/" in sourcePattern:
+            return glob.glob(os.path.join(glob.escape(testDir), sourcePattern))
+        # Simple patterns are matched against one listing of the directory, shared by all of them
+        # As with glob, files starting with '.' are only matched by patterns that start with '.'
+        matchHidden = sourcePattern.startswith(".")
+        names = self.getDirListing(testDir)
+        return [os.path.join(testDir, f) for f in names if fnmatch(f, sourcePattern) and (matchHidden or not f.startswith("."))]
+
+    def getDirListing(self, testDir):
+        names = self.dirListings.get(testDir)
+        if names is None:
+            try:
+                names = [entry.name for entry in os.scandir(testDir)]
+            except OSError:
+                names = []
+            self.dirListings[testDir] = names
+        return names
+
+    def clearDirListings(self, test):
+        for testDir in [test.getDirectory(temporary=1, local=1), test.getDirectory(temporary=1)]:
+            self.dirListings.pop(testDir, None)
 
     def findPaths(self, test, sourcePattern):
         self.diag.info("Looking for pattern " + sourcePattern + " for " + repr(test))
@@ -928,6 +1001,7 @@ class CreateCatalogue(plugins.Action):
         newPaths, ignoredPaths = self.findAllPaths(test)
         tmpDir = test.getDirectory(temporary=1, local=1)
         pathsLost, pathsEdited, pathsGained = self.findDifferences(oldPaths, newPaths, ignoredPaths, tmpDir)
+        pathsEditedShared = self.findEditedSharedFiles(oldPaths, newPaths, tmpDir)
         processesGained = self.findProcessesGained(test)
         fileName = test.makeTmpFileName("catalogue")
         with open(fileName, "w") as file:
@@ -942,6 +1016,9 @@ class CreateCatalogue(plugins.Action):
             if len(pathsLost) > 0:
                 file.write("\nThe following existing files/directories were deleted:\n")
                 self.writeFileStructure(file, pathsLost)
+            if len(pathsEditedShared) > 0:
+                file.write("\nThe following changed files are hard links to the test data, which has also changed:\n")
+                self.writeFileStructure(file, pathsEditedShared)
             if len(processesGained) > 0:
                 file.write("\nThe following processes were created:\n")
                 self.writeProcesses(file, processesGained)
@@ -990,20 +1067,30 @@ class CreateCatalogue(plugins.Action):
         return processes
 
     def findAllPaths(self, test):
+        # One walk of the sandbox, and at most one stat call per path
         allPaths = OrderedDict()
-        paths, ignoredPaths = test.listUnownedTmpPaths()
-        for path in paths:
-            editInfo = self.getEditInfo(path)
-            self.diag.info("Path " + path + " edit info " + editInfo)
-            allPaths[path] = editInfo
+        entries, ignoredPaths = test.listUnownedTmpEntries()
+        exactChanges = test.getConfigValue("catalogue_exact_changes") == "true"
+        for entry in entries:
+            editInfo = self.getEditInfo(entry, exactChanges)
+            self.diag.info("Path " + entry.path + " edit info " + repr(editInfo))
+            allPaths[entry.path] = editInfo
         return allPaths, ignoredPaths
 
-    def getEditInfo(self, fullPath):
+    def getEditInfo(self, entry, exactChanges):
         # Check modified times for files and directories, targets for links
-        if os.path.islink(fullPath):
-            return os.path.realpath(fullPath)
+        if entry.is_symlink():
+            return os.path.realpath(entry.path)
+        try:
+            statInfo = entry.stat()
+        except OSError:
+            # Dead links etc.
+            return time.strftime(plugins.datetimeFormat, time.localtime(None))
+        if exactChanges:
+            # Also catches changes within the same second, and files replaced by others
+            return statInfo.st_ino, statInfo.st_size, statInfo.st_mtime_ns
         else:
-            return time.strftime(plugins.datetimeFormat, time.localtime(plugins.modifiedTime(fullPath)))
+            return time.strftime(plugins.datetimeFormat, time.localtime(int(statInfo.st_mtime)))
 
     def findDifferences(self, oldPaths, newPaths, ignoredPaths, writeDir):
         pathsGained, pathsEdited, pathsLost = [], [], []
@@ -1025,6 +1112,15 @@ class CreateCatalogue(plugins.Action):
         self.removeParents(pathsLost, pathsLost)
         return pathsLost, pathsEdited, pathsGained
 
+    def findEditedSharedFiles(self, oldPaths, newPaths, writeDir):
+        # Files from copy_test_path_hardlink are shared with the test data, so writing to them changes it
+        sharedPaths = []
+        for path, editInfo in list(newPaths.items()):
+            if path in oldPaths and oldPaths[path] != editInfo and not os.path.islink(path) and \
+                    os.path.isfile(path) and os.stat(path).st_nlink > 1:
+                sharedPaths.append(self.outputPathName(path, writeDir))
+        return sharedPaths
+
     def removeParents(self, toRemove, toFind):
         removeList = []
         for path in toFind:
@@ -1097,6 +1193,15 @@ class UNIXPerformanceInfoFinder:
                 realTime = self.parseUnixTime(line)
         return cpuTime, realTime
 
+    def findMemoryUsedBy(self, test):
+        tmpFile = test.makeTmpFileName("unixmemory", forFramework=1)
+        self.diag.info("Reading memory file " + tmpFile)
+        if os.path.isfile(tmpFile):
+            with open(tmpFile) as f:
+                for line in f:
+                    if line.startswith("maxrss"):
+                        return self.parseUnixTime(line)
+
     def parseUnixTime(self, line):
         # Assumes output of GNU time
         words = line.strip().split()
@@ -1119,6 +1224,10 @@ class MakePerformanceFile(PerformanceFileCreator):
         self.systemPerfInfoFinder.setUpApplication(app)
 
     def makePerformanceFiles(self, test):
+        memory = self.systemPerfInfoFinder.findMemoryUsedBy(test)
+        if memory is not None:
+            self.writeMemoryFile(test, memory, test.makeTmpFileName("memory"))
+
         cpuTime, realTime = self.systemPerfInfoFinder.findTimesUsedBy(test)
         # There was still an error (jobs killed in emergency), so don't write performance files
         if cpuTime is None:
@@ -1139,6 +1248,11 @@ class MakePerformanceFile(PerformanceFileCreator):
             file.write(realLine)
         file.write(self.machineInfoFinder.getMachineInformation(test))
 
+    def writeMemoryFile(self, test, memory, fileName):
+        unit = test.getCompositeConfigValue("performance_unit", "memory")
+        with open(fileName, "w") as file:
+            file.write("Max Memory  :      " + str(round(memory, 2)) + " " + unit + "\n")
+
 # Relies on the config entry performance_logfile_extractor, so looks in the log file for anything reported
 # by the program
 
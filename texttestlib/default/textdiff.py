@@ -0,0 +1,309 @@
+""" In-process textual comparison of result files, producing output in the format of 'diff'.
+Used for the previews when text_diff_program is set to 'builtin', and built to stop as soon as
+enough of the difference has been found, rather than comparing the whole of two large files """
+
+import os
+import mmap
+import difflib
+from bisect import bisect_left
+from itertools import islice, chain
+
+builtinToolName = "builtin"
+# How many bytes to compare at a time when looking for the first and last differences
+_blockSize = 1024 * 1024
+# How many lines of each file to compare at a time, and the most we'll go up to if no common lines are found
+_windowLines = 2000
+_maxWindowLines = 64000
+# Regions larger than this without unique common lines are compared with difflib only if it's affordable
+_maxDifflibProduct = 4000000
+
+
+class _MappedFile:
+    """ Read-only access to a file via a memory map, so that large files don't need to be read into memory """
+    def __init__(self, fileName):
+        self.file = open(fileName, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b""
+
+    def close(self):
+        if self.size:
+            self.data.close()
+        self.file.close()
+
+    def isLineStart(self, pos):
+        return pos == 0 or self.data[pos - 1:pos] == b"\n"
+
+    def countLines(self, end):
+        count = 0
+        for pos in range(0, end, _blockSize):
+            count += self.data[pos:min(pos + _blockSize, end)].count(b"\n")
+        return count
+
+
+class _LineReader:
+    """ Reads lines from part of a mapped file, a few at a time """
+    def __init__(self, mappedFile, start, end):
+        self.data = mappedFile.data
+        self.pos = start
+        self.end = end
+
+    def atEnd(self):
+        return self.pos == self.end
+
+    def skip(self, length):
+        lines = 0
+        for pos in range(self.pos, self.pos + length, _blockSize):
+            lines += self.data[pos:min(pos + _blockSize, self.pos + length)].count(b"\n")
+        self.pos += length
+        return lines
+
+    def countLines(self):
+        # How many lines are left, the last one may have no newline
+        lines = self.data[self.pos:self.end].count(b"\n")
+        if self.pos < self.end and self.data[self.end - 1:self.end] != b"\n":
+            lines += 1
+        return lines
+
+    def iterLines(self):
+        while not self.atEnd():
+            yield from self.read(_windowLines)
+
+    def read(self, count):
+        lines = []
+        while len(lines) < count and self.pos < self.end:
+            newline = self.data.find(b"\n", self.pos, self.end)
+            nextPos = newline + 1 if newline != -1 else self.end
+            lines.append(self.data[self.pos:nextPos])
+            self.pos = nextPos
+        return lines
+
+
+def _findCommonPrefixLength(data1, data2, size, start1=0, start2=0):
+    length = 0
+    while length < size:
+        blockLength = min(length + _blockSize, size)
+        if data1[start1 + length:start1 + blockLength] != data2[start2 + length:start2 + blockLength]:
+            return _bisectDifference(data1, data2, length, blockLength,
+                                     lambda lo, hi: (start1 + lo, start1 + hi), lambda lo, hi: (start2 + lo, start2 + hi))
+        length = blockLength
+    return size
+
+
+def _findCommonSuffixLength(data1, data2, size1, size2, maxLength):
+    length = 0
+    while length < maxLength:
+        blockLength = min(length + _blockSize, maxLength)
+        if data1[size1 - blockLength:size1 - length] != data2[size2 - blockLength:size2 - length]:
+            return _bisectDifference(data1, data2, length, blockLength,
+                                     lambda lo, hi: (size1 - hi, size1 - lo), lambda lo, hi: (size2 - hi, size2 - lo))
+        length = blockLength
+    return maxLength
+
+
+def _bisectDifference(data1, data2, equalUpTo, differentBy, range1, range2=None):
+    # Find the smallest length in (equalUpTo, differentBy] where the data stops matching.
+    # The range functions convert a length into the byte range to compare in each file
+    range2 = range2 or range1
+    lo, hi = equalUpTo, differentBy
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        start1, end1 = range1(lo, mid)
+        start2, end2 = range2(lo, mid)
+        if data1[start1:end1] == data2[start2:end2]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def _findUniqueAnchors(a, b, alo, ahi, blo, bhi):
+    # The longest increasing sequence of lines that occur exactly once in each region (patience diff)
+    counts = {}
+    for i in range(alo, ahi):
+        line = a[i]
+        count, _ = counts.get(line, (0, None))
+        counts[line] = count + 1, i
+    bIndices = {}
+    for j in range(blo, bhi):
+        line = b[j]
+        if line in counts:
+            bIndices[line] = j if line not in bIndices else None
+    pairs = []
+    for line, j in bIndices.items():
+        count, i = counts[line]
+        if j is not None and count == 1:
+            pairs.append((i, j))
+    pairs.sort()
+    tails, tailIndices, previous = [], [], []
+    for index, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tailIndices.append(index)
+        else:
+            tails[pos] = j
+            tailIndices[pos] = index
+        previous.append(tailIndices[pos - 1] if pos > 0 else None)
+    anchors = []
+    index = tailIndices[-1] if tailIndices else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def _matchLines(a, b, alo, ahi, blo, bhi, matches, depth=0):
+    startMatches = []
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        startMatches.append((alo, blo))
+        alo += 1
+        blo += 1
+    matches += startMatches
+    endMatches = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        endMatches.append((ahi, bhi))
+    if alo < ahi and blo < bhi:
+        anchors = _findUniqueAnchors(a, b, alo, ahi, blo, bhi) if depth < 50 else []
+        if anchors:
+            for ai, bi in anchors:
+                _matchLines(a, b, alo, ai, blo, bi, matches, depth + 1)
+                matches.append((ai, bi))
+                alo, blo = ai + 1, bi + 1
+            _matchLines(a, b, alo, ahi, blo, bhi, matches, depth + 1)
+        elif (ahi - alo) * (bhi - blo) <= _maxDifflibProduct:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                matches += [(alo + i + k, blo + j + k) for k in range(size)]
+    matches += reversed(endMatches)
+
+
+def _formatRange(start, end):
+    # 0-based half-open range to diff's 1-based inclusive notation
+    if end - start == 1:
+        return str(end)
+    elif end == start:
+        return str(start)
+    else:
+        return str(start + 1) + "," + str(end)
+
+
+def _formatLines(prefix, lines):
+    for line in lines:
+        text = str(line, errors="ignore").replace("\r\n", "\n")
+        if text.endswith("\n"):
+            yield prefix + text
+        else:
+            yield prefix + text + "\n"
+            yield "\\ No newline at end of file\n"
+
+
+def _formatHunk(a, b, alo, ahi, blo, bhi, aOffset, bOffset):
+    yield from _formatHunkLines(a[alo:ahi], b[blo:bhi], alo, ahi, blo, bhi, aOffset, bOffset)
+
+
+def _formatHunkLines(aLines, bLines, alo, ahi, blo, bhi, aOffset, bOffset):
+    # The lines can be any iterables, so long as the ranges say how many there are
+    if ahi > alo and bhi > blo:
+        yield _formatRange(aOffset + alo, aOffset + ahi) + "c" + _formatRange(bOffset + blo, bOffset + bhi) + "\n"
+        yield from _formatLines("< ", aLines)
+        yield "---\n"
+        yield from _formatLines("> ", bLines)
+    elif ahi > alo:
+        yield _formatRange(aOffset + alo, aOffset + ahi) + "d" + str(bOffset + blo) + "\n"
+        yield from _formatLines("< ", aLines)
+    elif bhi > blo:
+        yield str(aOffset + alo) + "a" + _formatRange(bOffset + blo, bOffset + bhi) + "\n"
+        yield from _formatLines("> ", bLines)
+
+
+def _formatFinalHunk(a, b, reader1, reader2, aOffset, bOffset):
+    # Everything left in both files as one difference, reading the rest of them only as it's written
+    ahi, bhi = len(a) + reader1.countLines(), len(b) + reader2.countLines()
+    yield from _formatHunkLines(chain(a, reader1.iterLines()), chain(b, reader2.iterLines()), 0, ahi, 0, bhi, aOffset, bOffset)
+
+
+def _skipCommonLines(reader1, reader2):
+    # Find the next difference by comparing bytes rather than lines, which is much faster
+    size = min(reader1.end - reader1.pos, reader2.end - reader2.pos)
+    length = _findCommonPrefixLength(reader1.data, reader2.data, size, reader1.pos, reader2.pos)
+    if length < reader1.end - reader1.pos or length < reader2.end - reader2.pos:
+        # Back up to the start of the line where the difference is
+        length = reader1.data.rfind(b"\n", reader1.pos, reader1.pos + length) + 1 - reader1.pos
+        length = max(length, 0)
+    reader2.skip(length)
+    return reader1.skip(length)
+
+
+def _iterDiffLines(file1, file2):
+    commonLength = min(file1.size, file2.size)
+    prefixLength = _findCommonPrefixLength(file1.data, file2.data, commonLength)
+    if prefixLength == file1.size == file2.size:
+        return
+    # Back up to the start of the line where the first difference is
+    start = file1.data.rfind(b"\n", 0, prefixLength) + 1
+    suffixLength = _findCommonSuffixLength(file1.data, file2.data, file1.size, file2.size, commonLength - start)
+    end1, end2 = file1.size - suffixLength, file2.size - suffixLength
+    if not file1.isLineStart(end1) or not file2.isLineStart(end2):
+        # Move forward to a line start shared by both, or the end of the files
+        newline = file1.data.find(b"\n", end1, file1.size)
+        skip = newline + 1 - end1 if newline != -1 else file1.size - end1
+        end1 += skip
+        end2 += skip
+    aOffset = bOffset = file1.countLines(start)
+    reader1, reader2 = _LineReader(file1, start, end1), _LineReader(file2, start, end2)
+    a, b = reader1.read(_windowLines), reader2.read(_windowLines)
+    windowLines = _windowLines
+    while True:
+        atEnd = reader1.atEnd() and reader2.atEnd()
+        matches = []
+        _matchLines(a, b, 0, len(a), 0, len(b), matches)
+        if not atEnd and not matches and (reader1.atEnd() or reader2.atEnd()):
+            # One file has no lines left, so nothing else can match. Giving up part way would report its last line
+            # before the rest of the other file, which isn't valid if that line has no newline at the end
+            yield from _formatFinalHunk(a, b, reader1, reader2, aOffset, bOffset)
+            return
+        if not atEnd and not matches and windowLines < _maxWindowLines:
+            # Nothing in common yet, look further ahead before deciding what to report
+            a += reader1.read(windowLines)
+            b += reader2.read(windowLines)
+            windowLines *= 2
+            continue
+        if atEnd or not matches:
+            # Report everything left. If we're not at the end, we've given up looking for common lines
+            matches.append((len(a), len(b)))
+        alo, blo = 0, 0
+        for ai, bi in matches:
+            yield from _formatHunk(a, b, alo, ai, blo, bi, aOffset, bOffset)
+            alo, blo = ai + 1, bi + 1
+        if atEnd:
+            return
+        # Continue after the last match in the window, what follows it might match lines not read yet
+        lastA, lastB = matches[-1]
+        keepFromA, keepFromB = min(lastA + 1, len(a)), min(lastB + 1, len(b))
+        aOffset += keepFromA
+        bOffset += keepFromB
+        a, b = a[keepFromA:], b[keepFromB:]
+        if not a and not b:
+            skippedLines = _skipCommonLines(reader1, reader2)
+            aOffset += skippedLines
+            bOffset += skippedLines
+        a += reader1.read(_windowLines - len(a))
+        b += reader2.read(_windowLines - len(b))
+        windowLines = _windowLines
+
+
+def getDiffLines(fileName1, fileName2, maxLines=None):
+    """ Lines of output describing the differences between two files, as 'diff' would present them.
+    Stops after maxLines, if it is given """
+    file1, file2 = _MappedFile(fileName1), _MappedFile(fileName2)
+    try:
+        return list(islice(_iterDiffLines(file1, file2), maxLines))
+    finally:
+        file1.close()
+        file2.close()
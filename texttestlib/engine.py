@@ -8,7 +8,6 @@ import operator
 import logging
 from threading import Thread
 from collections import OrderedDict
-from time import sleep
 from glob import glob
 from copy import copy
 import time
@@ -123,7 +122,8 @@ class Activator(plugins.Responder, plugins.Observable):
         self.notify("StartRead")
         for suite in self.suites:
             try:
-                self.readTestSuiteContents(suite)
+                with plugins.startupProfiler.phase("test suite reading"):
+                    self.readTestSuiteContents(suite)
                 self.diag.info("SUCCESS: Created test suite of size " + str(suite.size()))
 
                 if suite.size() > 0 or self.allowEmpty:
@@ -138,6 +138,7 @@ class Activator(plugins.Responder, plugins.Observable):
 
         if len(rejectionInfo) > 0:
             self.writeErrors(rejectionInfo)
+        plugins.startupProfiler.report()
         # triggers the ActionRunner to start if needed, do this in the same thread!
         self.performNotify("AllReadAndNotified")
         return goodSuites
@@ -166,6 +167,8 @@ class TextTest(plugins.Responder, plugins.Observable):
             signal.signal(signal.SIGQUIT, self.printStackTrace)
         self.setSignalHandlers(self.handleSignalWhileStarting)
         self.inputOptions = testmodel.OptionFinder()
+        if "profile-startup" in self.inputOptions:
+            plugins.startupProfiler.enable()
         self.diag = logging.getLogger("Find Applications")
         self.appSuites = OrderedDict()
         self.exitCode = 0
@@ -392,7 +395,8 @@ class TextTest(plugins.Responder, plugins.Observable):
             pass  # already written about this
 
     def _run(self):
-        appFindingWroteError, allApps = self.findApps()
+        with plugins.startupProfiler.phase("application discovery"):
+            appFindingWroteError, allApps = self.findApps()
         if self.inputOptions.helpMode():
             if len(allApps) > 0:
                 allApps[0].printHelpText()
@@ -429,8 +433,10 @@ class TextTest(plugins.Responder, plugins.Observable):
         return validOptions
 
     def createAndRunSuites(self, allApps):
-        self.createResponders(allApps)
-        raisedError, self.appSuites = self.createTestSuites(allApps)
+        with plugins.startupProfiler.phase("responder creation"):
+            self.createResponders(allApps)
+        with plugins.startupProfiler.phase("test suite reading"):
+            raisedError, self.appSuites = self.createTestSuites(allApps)
         if not raisedError or len(self.appSuites) > 0:
             self.addSuites(list(self.appSuites.values()), allApps)
 
@@ -544,18 +550,15 @@ class TextTest(plugins.Responder, plugins.Observable):
 
     def waitForThreads(self, allThreads):
         # Need to wait for the threads to terminate in a way that allows signals to be
-        # caught. thread.join doesn't do this. signal.pause seems like a good idea but
-        # doesn't return unless a signal is caught, leading to sending "fake" ones from the
-        # threads when they finish. And playing with signals and threads together is playing with fire...
-
-        # So we poll, which we don't really want to do, but it seems better than using Twisted or asyncore
-        # just for this :) With a long enough sleep it shouldn't generate too much load...
+        # caught. Joining with a timeout returns as soon as the thread terminates, and the timeout
+        # makes sure we get back to the interpreter regularly to run signal handlers even on
+        # platforms where an unlimited join can't be interrupted.
 
         # See http://groups.google.com/group/comp.lang.python/browse_thread/thread/a244905b86f06e48/7e969a0c7932fa91#
         currThreads = self.aliveThreads(allThreads)
         threadCount = len(currThreads)
         while threadCount > 0:
-            sleep(0.5)
+            currThreads[0].join(0.5)
             currThreads = self.aliveThreads(currThreads)
             if len(currThreads) < threadCount:
                 self.diag.info("Thread(s) terminated, remaining are " + repr([t.name for t in currThreads]))
@@ -12,13 +12,13 @@ import shlex
 import types
 import fnmatch
 import subprocess
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from traceback import format_exception
 from threading import currentThread, RLock
-from queue import Queue, Empty
 from glob import glob
 from datetime import datetime
-from pickle import Unpickler, UnpicklingError
+from pickle import Pickler, Unpickler, UnpicklingError
+from copy import deepcopy
 from locale import getpreferredencoding
 
 
@@ -109,6 +109,82 @@ def importAndCall(moduleName, callableName, *args):
     return namespace["_callable"](*args)
 
 
+class StartupProfiler:
+    """ Records how long each phase of starting up takes, for the --profile-startup switch.
+    Time spent in a phase started inside another one is counted only for the inner phase """
+    otherPhase = "other"
+
+    def __init__(self):
+        self.enabled = False
+        self.reported = False
+        self.phaseTimes = OrderedDict()
+        self.phaseStack = []
+        self.lastTime = None
+
+    def enable(self):
+        self.enabled = True
+        self.lastTime = time.perf_counter()
+        self.phaseStack = [self.otherPhase]
+        processTime = self.getTimeSinceProcessStart()
+        if processTime is not None:
+            self.phaseTimes["interpreter start and core imports"] = processTime
+
+    def getTimeSinceProcessStart(self):
+        try:
+            import psutil
+            return max(time.time() - psutil.Process().create_time(), 0.0)
+        except Exception:
+            return
+
+    def recordTime(self):
+        now = time.perf_counter()
+        current = self.phaseStack[-1]
+        self.phaseTimes[current] = self.phaseTimes.get(current, 0.0) + now - self.lastTime
+        self.lastTime = now
+
+    def startPhase(self, name):
+        if self.enabled and not self.reported and currentThread().name == "MainThread":
+            self.recordTime()
+            self.phaseStack.append(name)
+            return True
+        return False
+
+    def endPhase(self):
+        self.recordTime()
+        self.phaseStack.pop()
+
+    def phase(self, name):
+        return StartupPhase(self, name)
+
+    def report(self):
+        if not self.enabled or self.reported:
+            return
+        self.recordTime()
+        self.reported = True
+        total = sum(self.phaseTimes.values())
+        log.info("Startup time profile:")
+        for name, seconds in sorted(self.phaseTimes.items(), key=lambda item: -item[1]):
+            log.info("  " + name.ljust(40) + ("%.3f" % seconds).rjust(8) + " s")
+        log.info("  " + "total".ljust(40) + ("%.3f" % total).rjust(8) + " s")
+
+
+class StartupPhase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.started = False
+
+    def __enter__(self):
+        self.started = self.profiler.startPhase(self.name)
+
+    def __exit__(self, *args):
+        if self.started:
+            self.profiler.endPhase()
+
+
+startupProfiler = StartupProfiler()
+
+
 def installationDir(name):
     # Generic modules only, we're confident we know where they are
     return os.path.join(installationRoots[0], name)
@@ -351,6 +427,10 @@ class Filter:
     def acceptsTestSuiteContents(self, suiteArg):
         return 1
 
+    def acceptsTestPath(self, suiteArg, relPathArg):
+        # Called before anything is read for a test or suite, can only reject things that would definitely be rejected anyway
+        return 1
+
     def refine(self, tests):
         return tests
 
@@ -396,8 +476,28 @@ class TestSelectionFilter(TextFilter):
 
     def __init__(self, *args):
         self.diag = logging.getLogger("TestSelectionFilter")
-        self.fullSuites = []
+        self.fullSuites = set()
         TextFilter.__init__(self, *args)
+        self.selectedTexts = set(self.texts)
+        # All selected paths and their ancestors, and which of them select everything below them
+        self.selectedPaths = set()
+        self.fullSuitePaths = set()
+        self.indexSelectedPaths()
+
+    def indexSelectedPaths(self):
+        # A suite only selects all its contents if it is given before anything below it
+        firstPositions, firstDescendantPositions = {}, {}
+        for position, relPath in enumerate(self.texts):
+            firstPositions.setdefault(relPath, position)
+            parts = relPath.split(os.sep)
+            for i in range(len(parts)):
+                ancestorPath = os.sep.join(parts[:i + 1])
+                self.selectedPaths.add(ancestorPath)
+                if i < len(parts) - 1:
+                    firstDescendantPositions.setdefault(ancestorPath, position)
+        for relPath, position in firstPositions.items():
+            if position < firstDescendantPositions.get(relPath, len(self.texts)):
+                self.fullSuitePaths.add(relPath)
 
     def parseInput(self, filterText, app, suites):
         allEntries = TextFilter.parseInput(self, filterText, app, suites)
@@ -469,25 +569,28 @@ class TestSelectionFilter(TextFilter):
         return max(allApps, key=matchKey)
 
     def acceptsTestCase(self, test):
-        return test.getRelPath() in self.texts or self.hasFullSuiteAncestor(test.parent)
+        return test.getRelPath() in self.selectedTexts or self.hasFullSuiteAncestor(test.parent)
 
     def hasFullSuiteAncestor(self, suite):
-        return suite in self.fullSuites or (suite.parent and self.hasFullSuiteAncestor(suite.parent))
+        while suite:
+            if suite in self.fullSuites:
+                return True
+            suite = suite.parent
+        return False
 
     def acceptsTestSuite(self, suite):
         return self.suiteInTexts(suite) or (suite.parent and self.hasFullSuiteAncestor(suite.parent))
 
+    def acceptsTestPath(self, suite, relPath):
+        return relPath in self.selectedPaths or self.hasFullSuiteAncestor(suite)
+
     def suiteInTexts(self, suite):
         if suite.parent is None:
             return True  # don't eliminate the root suite :)
-        for relPath in self.texts:
-            suitePath = suite.getRelPath()
-            if relPath == suitePath:
-                self.fullSuites.append(suite)
-                return True
-            elif relPath.startswith(suitePath + os.sep):
-                return True
-        return False
+        suitePath = suite.getRelPath()
+        if suitePath in self.fullSuitePaths:
+            self.fullSuites.add(suite)
+        return suitePath in self.selectedPaths
 
 
 # Generic action to be performed: all actions need to provide these methods
@@ -553,8 +656,14 @@ def addCategory(name, briefDesc, longDesc=""):
 
 
 class ThreadedNotificationHandler:
+    # How much to handle in each idle callback, so the GUI keeps up without becoming unresponsive
+    maxEventsPerPoll = 200
+    maxPollTime = 0.05
+
     def __init__(self):
-        self.workQueue = Queue()
+        self.workQueue = deque()
+        self.waitingEvents = {}
+        self.latestEvents = {}
         self.mutex = RLock()
         self.active = False
         self.allowedEvents = []
@@ -575,35 +684,118 @@ class ThreadedNotificationHandler:
                 self.source = None
             self.idleHandler = None
 
-    def pollQueue(self):
+    def getSupersedingKey(self, observable, args):
+        # Events that make any still waiting to be handled out of date.
+        # Observables are kept alive by the queue, so their ids are unique while there
+        name = args[0]
+        if name in ["ActionProgress", "Status"]:
+            return id(observable), name
+        elif name == "LifecycleChange" and len(args) > 2:
+            return id(observable), name, args[2]
+
+    def getNextEvent(self):
         with self.mutex:
-            try:
-                observable, args, kwargs = self.workQueue.get_nowait()
-                if len(self.allowedEvents) == 0 or args[0] in self.allowedEvents:
-                    observable.diagnoseObs("From work queue", *args, **kwargs)
-                    observable.performNotify(*args, **kwargs)
-            except Empty:
-                self.source = None
+            while len(self.workQueue) > 0:
+                event = self.workQueue.popleft()
+                observable, args, _ = event
+                if observable is None:
+                    continue  # superseded by a later event
+                key = self.getSupersedingKey(observable, args)
+                if key is not None:
+                    self.waitingEvents.pop(key, None)
+                if self.latestEvents.get(id(observable)) is event:
+                    del self.latestEvents[id(observable)]
+                return event
+            self.source = None
+
+    def pollQueue(self):
+        endTime = time.monotonic() + self.maxPollTime
+        for _ in range(self.maxEventsPerPoll):
+            event = self.getNextEvent()
+            if event is None:
                 return False
-            return True
+            observable, args, kwargs = event
+            if len(self.allowedEvents) == 0 or args[0] in self.allowedEvents:
+                observable.diagnoseObs("From work queue", *args, **kwargs)
+                observable.performNotify(*args, **kwargs)
+            if self.idleHandler is None or time.monotonic() > endTime:
+                break
+        return True
 
     def transfer(self, observable, *args, **kwargs):
         with self.mutex:
-            self.workQueue.put((observable, args, kwargs))
+            key = self.getSupersedingKey(observable, args)
+            waitingEvent = self.waitingEvents.get(key) if key is not None else None
+            if waitingEvent is not None and self.latestEvents.get(id(observable)) is waitingEvent:
+                # Nothing else about this observable is waiting after it, so it can just tell the observers the latest
+                waitingEvent[1:] = args, kwargs
+            else:
+                if waitingEvent is not None:
+                    # Leave it in the queue, it's cheaper to skip it when we get to it
+                    waitingEvent[0] = None
+                event = [observable, args, kwargs]
+                self.workQueue.append(event)
+                self.latestEvents[id(observable)] = event
+                if key is not None:
+                    self.waitingEvents[key] = event
             if self.active and self.source is None and self.idleHandler is not None:
                 self.source = self.idleHandler()
 
 
+class ObserverDispatchTable:
+    """ Which observers in a list have a method for each event, worked out once for each event.
+    Shared between all observables with the same observers, which is usually all the tests """
+    tables = {}
+    maxTables = 1000
+
+    def __init__(self, observers):
+        self.observers = tuple(observers)
+        self.handlers = {}
+
+    @classmethod
+    def getTable(cls, observers):
+        key = tuple(map(id, observers))
+        table = cls.tables.get(key)
+        if table is None:
+            if len(cls.tables) >= cls.maxTables:
+                cls.tables.clear()
+            table = cls(observers)
+            cls.tables[key] = table
+        return table
+
+    @staticmethod
+    def hasDynamicAttributes(observer):
+        # These can't be asked in advance, the answer may change
+        return hasattr(observer.__class__, "__getattr__")
+
+    def getHandlers(self, methodName):
+        handlers = self.handlers.get(methodName)
+        if handlers is None:
+            handlers = []
+            for observer in self.observers:
+                if self.hasDynamicAttributes(observer):
+                    handlers.append((observer, True))
+                elif hasattr(observer, methodName):
+                    handlers.append((observer, False))
+            self.handlers[methodName] = handlers
+        return handlers
+
+
 class Observable:
     threadedNotificationHandler = ThreadedNotificationHandler()
     obsDiag = None
     LAST_OBSERVER = "last observer"
 
     @classmethod
-    def diagnoseObs(klass, message, *args, **kwargs):
+    def diagnosingObs(klass):
         if not klass.obsDiag:
             klass.obsDiag = logging.getLogger("Observable")
-        klass.obsDiag.info(message + " " + str(klass) + " " + repr(args) + repr(kwargs))
+        return klass.obsDiag.isEnabledFor(logging.INFO)
+
+    @classmethod
+    def diagnoseObs(klass, message, *args, **kwargs):
+        if klass.diagnosingObs():
+            klass.obsDiag.info(message + " " + str(klass) + " " + repr(args) + repr(kwargs))
 
     def __init__(self, passSelf=False):
         self.observers = []
@@ -611,10 +803,18 @@ class Observable:
 
     def addObserver(self, observer):
         self.observers.append(observer)
+        self.dispatchObservers = None
 
     def setObservers(self, observers):
         self.observers = [x for x in observers if x is not self]
 
+    def getDispatchTable(self):
+        # unpickled objects have not called __init__, and don't have this
+        if getattr(self, "dispatchObservers", None) is not self.observers:
+            self.dispatchTable = ObserverDispatchTable.getTable(self.observers)
+            self.dispatchObservers = self.observers
+        return self.dispatchTable
+
     def inMainThread(self):
         return currentThread().getName() == "MainThread"
 
@@ -645,9 +845,11 @@ class Observable:
     def performNotify(self, name, *args, **kwargs):
         methodName = "notify" + name
         lastObserver = None
-        for observer in self.observers:
-            if hasattr(observer, methodName):
-                self.diagnoseObs("Notify observer " + name + " " + str(observer.__class__))
+        diagnosing = self.diagnosingObs()
+        for observer, checkEachTime in self.getDispatchTable().getHandlers(methodName):
+            if not checkEachTime or hasattr(observer, methodName):
+                if diagnosing:
+                    self.diagnoseObs("Notify observer " + name + " " + str(observer.__class__))
                 answer = self.notifyObserver(observer, methodName, *args, **kwargs)
                 if answer == self.LAST_OBSERVER:
                     self.diagnoseObs("Setting as last observer", *args, **kwargs)
@@ -859,30 +1061,62 @@ class MarkedTestState(TestState):
 
 
 class TestStateUnpickler(Unpickler):
+    # Every state file refers to the same few classes, don't import them again for each one
+    classCache = {}
+
     def find_class(self, modName, className):
+        key = modName, className
+        cls = self.classCache.get(key)
+        if cls is None:
+            cls = self.findClassInModule(modName, className)
+            self.classCache[key] = cls
+        return cls
+
+    def findClassInModule(self, modName, className):
         try:
-            namespace = {}
-            exec("from " + modName + " import " + className + " as _class", globals(), namespace)
-            return namespace["_class"]
-        except ImportError as e:
+            return Unpickler.find_class(self, modName, className)
+        except (ImportError, AttributeError) as e:
             if not modName.startswith("texttestlib"):
                 try:
-                    return self.find_class("texttestlib." + modName, className)
+                    return Unpickler.find_class(self, "texttestlib." + modName, className)
                 except:
                     raise e
             else:
                 raise e
 
 
+# Test state files start with this and the version of the format, followed by the pickled state.
+# Files without it are older, and contain only a pickle of whichever protocol was used
+testStateHeader = b"#texttest-state "
+testStateFormatVersion = 1
+testStatePickleProtocol = 5
+
+
+def saveTestStateToFile(state, file):
+    file.write(testStateHeader + str(testStateFormatVersion).encode() + b"\n")
+    Pickler(file, protocol=testStatePickleProtocol).dump(state)
+
+
 def getNewTestStateFromFile(file):
-    unpickler = TestStateUnpickler(file)
+    start = file.read(len(testStateHeader))
+    if start == testStateHeader:
+        versionText = file.readline().strip()
+        if not versionText.isdigit():
+            raise UnpicklingError("Could not read test state format version " + repr(versionText))
+        version = int(versionText)
+        if version > testStateFormatVersion:
+            raise UnpicklingError("Test state was written in format version " + str(version) +
+                                  ", only versions up to " + str(testStateFormatVersion) + " can be read")
+        return TestStateUnpickler(file).load()
+
+    from io import BytesIO
+    data = start + file.read()
+    unpickler = TestStateUnpickler(BytesIO(data))
     try:
         return unpickler.load()
     except Exception:
         encoding = getpreferredencoding()
-        from io import BytesIO
-        file.seek(0)
-        unpickler = TestStateUnpickler(BytesIO(file.read().replace(b"\r\n", b"\n")), encoding=encoding, errors="replace")
+        unpickler = TestStateUnpickler(BytesIO(data.replace(b"\r\n", b"\n")), encoding=encoding, errors="replace")
         return unpickler.load()
     
 
@@ -1538,8 +1772,11 @@ class MultilineTextTrigger(TextTrigger):
 # Used for application and personal configuration files
 class MultiEntryDictionary(OrderedDict):
     warnings = []
+    notCached = object()
 
     def __init__(self, importKey="", importFileFinder=None, aliases={}, allowSectionHeaders=True, fileTrackSections={}, *args, **kw):
+        self.changeCount = 0
+        self.clearCache()
         OrderedDict.__init__(self, *args, **kw)
         self.diag = logging.getLogger("MultiEntryDictionary")
         self.aliases = aliases
@@ -1556,6 +1793,41 @@ class MultiEntryDictionary(OrderedDict):
         return self.__class__, (self.importKey, Callable(self.importFileFinder),
                                 self.aliases, self.allowSectionHeaders, self.fileTrackSections, items)
 
+    def clearCache(self):
+        # Composite values are resolved once per key and sub-key, and the sub-key patterns of each
+        # section compiled once. Always called after changing anything: lookups in progress on other threads
+        # will then store their results in the old cache, which is thrown away
+        self.compositeCache = {}
+        self.sectionMatchers = {}
+        self.changeCount += 1
+
+    def getCompositeCache(self):
+        return self.compositeCache
+
+    def getCacheVersion(self):
+        return self.changeCount
+
+    def __setitem__(self, key, value):
+        OrderedDict.__setitem__(self, key, value)
+        self.clearCache()
+
+    def __delitem__(self, key):
+        OrderedDict.__delitem__(self, key)
+        self.clearCache()
+
+    def clear(self):
+        OrderedDict.clear(self)
+        self.clearCache()
+
+    def pop(self, *args):
+        value = OrderedDict.pop(self, *args)
+        self.clearCache()
+        return value
+
+    def update(self, *args, **kw):
+        OrderedDict.update(self, *args, **kw)
+        self.clearCache()
+
     def addFileTracking(self, key):
         self.fileTrackSections[key] = {}
 
@@ -1646,6 +1918,7 @@ class MultiEntryDictionary(OrderedDict):
         except ValueError:
             self.warn("Config entry name '" + entryName + "' in section '" + currSection +
                       "' given an invalid value '" + entry + "', ignoring.")
+        self.clearCache()
 
     def removeEntry(self, entryName, entry, sectionName=""):
         currDict, _ = self.getSectionInfo(sectionName)
@@ -1653,6 +1926,7 @@ class MultiEntryDictionary(OrderedDict):
             dictElem = currDict[entryName]
             if entry in dictElem:
                 dictElem.remove(entry)
+                self.clearCache()
 
     def _addEntry(self, entryName, entry, currDict, currSection,
                   insert=True, errorOnUnknown=False, errorOnClashWithGlobal=True):
@@ -1733,14 +2007,37 @@ class MultiEntryDictionary(OrderedDict):
             return value
 
     def getCompositeUnexpanded(self, key, subKey, defaultSubKey="default"):
+        cache = self.getCompositeCache()
+        cacheKey = key, subKey, defaultSubKey
+        try:
+            value = cache.get(cacheKey, self.notCached)
+        except TypeError:  # unhashable sub-key, just work it out
+            return self.resolveComposite(key, subKey, defaultSubKey)
+        if value is self.notCached:
+            value = self.resolveComposite(key, subKey, defaultSubKey)
+            cache[cacheKey] = value
+        # Lists are always built up here, so callers have been free to change them
+        return list(value) if type(value) == list else value
+
+    def getSectionMatchers(self, key, dict):
+        matchers = self.sectionMatchers.get(key)
+        if matchers is None:
+            # As fnmatch.fnmatch does, but without normalising and looking up each pattern every time
+            matchers = [(re.compile(fnmatch.translate(os.path.normcase(currSubKey))).match, currValue)
+                        for currSubKey, currValue in dict.items()]
+            self.sectionMatchers[key] = matchers
+        return matchers
+
+    def resolveComposite(self, key, subKey, defaultSubKey):
         dict = self.get(key)
         # If it wasn't a dictionary, return None
         if not hasattr(dict, "items"):
             return None
         listVal = []
         usingList = False
-        for currSubKey, currValue in dict.items():
-            if fnmatch.fnmatch(subKey, currSubKey):
+        normSubKey = os.path.normcase(subKey) if len(dict) else subKey
+        for matcher, currValue in self.getSectionMatchers(key, dict):
+            if matcher(normSubKey):
                 if type(currValue) == list:
                     listVal += currValue
                     usingList = True
@@ -1759,12 +2056,17 @@ class MultiEntryDictionary(OrderedDict):
         if usingList:
             return listVal
 
+    @staticmethod
+    def expandString(value, envMapping):
+        # Most values don't refer to the environment at all
+        return string.Template(value).safe_substitute(envMapping) if "$" in value else value
+
     @classmethod
     def expandEnvironment(cls, value, envMapping):
         if isinstance(value, str):
-            return string.Template(value).safe_substitute(envMapping)
+            return cls.expandString(value, envMapping)
         elif isinstance(value, list):
-            return [string.Template(element).safe_substitute(envMapping) for element in value]
+            return [cls.expandString(element, envMapping) for element in value]
         elif isinstance(value, dict):
             newDict = value.__class__()
             for key, val in list(value.items()):
@@ -1774,6 +2076,120 @@ class MultiEntryDictionary(OrderedDict):
             return value
 
 
+class ConfigOverlay(MultiEntryDictionary):
+    """ Configuration for a part of the test suite with its own config files. Only the entries those files
+    change are stored here, each copied from the parent configuration the first time it is changed:
+    everything else is looked up in the parent """
+    def __init__(self, parent):
+        self.parent = parent
+        self.parentVersion = parent.getCacheVersion()
+        fileTrackSections = OrderedDict((key, OrderedDict()) for key in parent.fileTrackSections)
+        MultiEntryDictionary.__init__(self, parent.importKey, parent.importFileFinder,
+                                      parent.aliases, parent.allowSectionHeaders, fileTrackSections)
+
+    def __reduce__(self):
+        # Copies don't need to stay linked to the parent
+        items = [[k, self[k]] for k in self]
+        return MultiEntryDictionary, (self.importKey, Callable(self.importFileFinder), self.aliases,
+                                      self.allowSectionHeaders, self.getAllFileTrackSections(), items)
+
+    def isLocal(self, key):
+        return OrderedDict.__contains__(self, key)
+
+    def getLocalEntry(self, key):
+        if not self.isLocal(key) and key in self.parent:
+            OrderedDict.__setitem__(self, key, deepcopy(self.parent[key]))
+            self.clearCache()
+        return OrderedDict.__getitem__(self, key)
+
+    def __getitem__(self, key):
+        if self.isLocal(key):
+            return OrderedDict.__getitem__(self, key)
+        else:
+            return self.parent[key]
+
+    def __contains__(self, key):
+        return self.isLocal(key) or key in self.parent
+
+    def get(self, key, default=None):
+        if self.isLocal(key):
+            return OrderedDict.__getitem__(self, key)
+        else:
+            return self.parent.get(key, default)
+
+    def __iter__(self):
+        yield from self.parent
+        for key in OrderedDict.__iter__(self):
+            if key not in self.parent:
+                yield key
+
+    def __len__(self):
+        return len(self.parent) + sum(1 for key in OrderedDict.__iter__(self) if key not in self.parent)
+
+    def __bool__(self):
+        return bool(self.parent) or OrderedDict.__len__(self) > 0
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + repr(self.items()) + ")"
+
+    def getCompositeCache(self):
+        # Our cached values may come from the parent, which can also change
+        parentVersion = self.parent.getCacheVersion()
+        if parentVersion != self.parentVersion:
+            self.parentVersion = parentVersion
+            self.clearCache()
+        return self.compositeCache
+
+    def getCacheVersion(self):
+        return self.changeCount, self.parent.getCacheVersion()
+
+    def getSectionInfo(self, sectionName=""):
+        if sectionName and sectionName != "end":
+            return self.getLocalEntry(sectionName), sectionName
+        else:
+            return self, "<global>"
+
+    def getNewSectionInfo(self, line, *args, **kw):
+        name = self.getEntryName(line[1:-1])
+        if name in self.parent:
+            self.getLocalEntry(name)
+        return MultiEntryDictionary.getNewSectionInfo(self, line, *args, **kw)
+
+    def insertEntry(self, entryName, entry, currDict):
+        if currDict is self:
+            self.getLocalEntry(entryName)
+        MultiEntryDictionary.insertEntry(self, entryName, entry, currDict)
+
+    def removeEntry(self, entryName, entry, sectionName=""):
+        if not sectionName and entryName in self:
+            self.getLocalEntry(entryName)
+        MultiEntryDictionary.removeEntry(self, entryName, entry, sectionName)
+
+    def getAllFileTrackSections(self):
+        allSections = deepcopy(self.parent.fileTrackSections)
+        for sectionName, valueDict in self.fileTrackSections.items():
+            for value, entries in valueDict.items():
+                allSections.setdefault(sectionName, OrderedDict()).setdefault(value, []).extend(entries)
+        return allSections
+
+    def getFileDefining(self, *args, **kw):
+        # Entries in the parent configuration were read first, so they take precedence as before
+        filename, entryName = self.parent.getFileDefining(*args, **kw)
+        if filename:
+            return filename, entryName
+        else:
+            return MultiEntryDictionary.getFileDefining(self, *args, **kw)
+
+
 class Option:
     def __init__(self, name, value, description, changeMethod):
         self.name = name
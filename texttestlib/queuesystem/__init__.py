@@ -389,6 +389,8 @@ class QueueSystemConfig(default.Config):
                              "Grid engine resources required to locate machine to run proxy process")
         app.setConfigDefault("queue_system_core_file_location", "",
                              "System-wide location for core files from grid jobs, in case TEXTTEST_TMP is generated")
+        app.setConfigDefault("queue_system_persistent_connection", 1,
+                             "Should slave jobs keep one connection open to the master for all their messages?")
         app.addConfigEntry("builtin", "proxy_options", "definition_file_stems")
 
     def setDependentConfigDefaults(self, app):
@@ -28,6 +28,9 @@ class QueueSystem(object):
     def supportsPolling(self):
         return True
 
+    def setJobExitHandler(self, handler):
+        pass  # We only find out that jobs have exited by polling
+
     def findErrorMessage(self, stderr, *args):
         if len(stderr) > 0:
             basicError = self.findSubmitError(stderr)
@@ -6,12 +6,17 @@ import os
 import signal
 from . import abstractqueuesystem
 from multiprocessing import cpu_count
+from threading import Thread
 from texttestlib import plugins
 
 
 class QueueSystem(abstractqueuesystem.QueueSystem):
     def __init__(self, *args):
         self.processes = {}
+        self.jobExitHandler = None
+
+    def setJobExitHandler(self, handler):
+        self.jobExitHandler = handler
 
     def submitSlaveJob(self, cmdArgs, slaveEnv, logDir, submissionRules, jobType):
         outputFile, errorsFile = submissionRules.getJobFiles()
@@ -33,8 +38,15 @@ class QueueSystem(abstractqueuesystem.QueueSystem):
         else:
             jobId = str(process.pid)
             self.processes[jobId] = process
+            if self.jobExitHandler:
+                Thread(target=self.waitForExit, args=(process,), daemon=True).start()
             return jobId, None
 
+    def waitForExit(self, process):
+        # Tell the master straight away, so it can check for slaves that exited without reporting back
+        process.wait()
+        self.jobExitHandler()
+
     def getCapacity(self):
         return cpu_count()
 
@@ -11,7 +11,7 @@ import time
 from .utils import *
 from queue import Queue
 from socketserver import ThreadingTCPServer, StreamRequestHandler
-from threading import RLock, Lock
+from threading import RLock, Lock, Event
 from collections import OrderedDict
 from texttestlib import plugins
 from texttestlib.default.console import TextDisplayResponder, InteractiveResponder
@@ -19,6 +19,7 @@ from texttestlib.default.knownbugs import CheckForBugs
 from texttestlib.default.actionrunner import BaseActionRunner
 from texttestlib.default.performance import getTestPerformance
 from glob import glob
+from io import BytesIO
 from locale import getpreferredencoding
 
 plugins.addCategory("abandoned", "abandoned", "were abandoned")
@@ -68,6 +69,7 @@ class QueueSystemServer(BaseActionRunner):
         self.slaveLogDirs = set()
         self.delayedTestsForAdd = []
         self.remainingForApp = OrderedDict()
+        self.pollWakeup = Event()
         appCapacities = []
         for app in allApps:
             appCapacity = self.maxCapacity
@@ -159,17 +161,16 @@ class QueueSystemServer(BaseActionRunner):
 
     def pollQueueSystem(self):
         # Start by polling after 5 seconds, ever after try every 15
+        # Woken up early when everything completes, we are killed, or the queue system knows a job has exited
         interval = float(os.getenv("TEXTTEST_QS_POLL_INTERVAL", "0.5"))         # Amount of time to wait between checks for exit/completion when polling grid/cloud
         attempts = int(float(os.getenv("TEXTTEST_QS_POLL_WAIT", "5")) / interval) # Amount of time to wait before initiating polling of grid/cloud
         subsequentAttempts = int(float(os.getenv("TEXTTEST_QS_POLL_SUBSEQUENT_WAIT", "15")) / interval) # Amount of time to wait before subsequent polling of grid/cloud
         if attempts >= 0:
             while True:
-                for _ in range(attempts):
-                    time.sleep(interval)
-                    if self.allComplete:
-                        return
-                    if self.exited:
-                        break
+                self.pollWakeup.wait(interval if self.exited else attempts * interval)
+                self.pollWakeup.clear()
+                if self.allComplete:
+                    return
                 if not self.exited:
                     self.updateJobStatus()
                 attempts = subsequentAttempts
@@ -178,6 +179,9 @@ class QueueSystemServer(BaseActionRunner):
                 # In case any tests have had reruns triggered since we stopped submitting
                 self.runQueue(self.getTestForRun, self.runTest, "rerunning", block=False)
 
+    def wakePolling(self):
+        self.pollWakeup.set()
+
     def canPoll(self):
         queueSystem = self.getQueueSystem(list(self.jobs.keys())[0])
         return queueSystem.supportsPolling()
@@ -363,6 +367,7 @@ class QueueSystemServer(BaseActionRunner):
 
     def notifyAllComplete(self):
         BaseActionRunner.notifyAllComplete(self)
+        self.wakePolling()
         self.cleanup(final=True)
         if self.reuseOnly: # could still be hanging waiting for this, make sure we terminate
             self.submitTerminators()
@@ -642,6 +647,7 @@ class QueueSystemServer(BaseActionRunner):
         command = "from ." + queueModule + " import QueueSystem as _QueueSystem"
         exec(command, globals(), namespace)
         system = namespace["_QueueSystem"](test)
+        system.setJobExitHandler(self.wakePolling)
         self.queueSystems[queueModule] = system
         return system
 
@@ -650,6 +656,7 @@ class QueueSystemServer(BaseActionRunner):
         self.handleLocalError(test, previouslySubmitted)
 
     def killTests(self):
+        self.wakePolling()
         # If we've been killed with some sort of limit signal, wait here until we know
         # all tests terminate. Otherwise we rely on them terminating naturally, and if they don't
         wantStatus = self.killSignal and self.killSignal not in [signal.SIGINT, signal.SIGTERM]
@@ -964,30 +971,52 @@ class SlaveRequestHandler(StreamRequestHandler):
         if identifier == "TERMINATE_SERVER":
             return
 
-        self.handleMessage(identifier)
-
-    def handleMessage(self, identifier):
+        if identifier == persistentConnectionText:
+            self.handlePersistentConnection()
+        else:
+            self.handleMessage(identifier, self.rfile, self.wfile)
+            self.connection.shutdown(socket.SHUT_RDWR)
+
+    def handlePersistentConnection(self):
+        # The slave waits for the response to each message before sending another,
+        # so it can never get further ahead of us than one message
+        self.server.diag.info("Opened persistent connection from " + self.client_address[0])
+        while True:
+            try:
+                frame = openFrame(self.rfile)
+            except socket.error:
+                frame = None
+            if frame is None:
+                break
+
+            wfile = BytesIO()
+            identifier = str(frame.readline().strip(), getpreferredencoding())
+            self.handleMessage(identifier, frame, wfile)
+            frame.finish()
+            sendFrame(self.connection, wfile.getvalue())
+        self.server.diag.info("Closed persistent connection from " + self.client_address[0])
+
+    def handleMessage(self, identifier, rfile, wfile):
         # Don't use port, it changes all the time
         identifier, sendFiles, getFiles, tryReuse, rerun = parseIdentifier(identifier)
-        testString = str(self.rfile.readline().strip(), getpreferredencoding())
+        testString = str(rfile.readline().strip(), getpreferredencoding())
         test = self.server.getTest(testString)
         if test is None:
             clientHost = self.client_address[0]
             sys.stderr.write("WARNING: Received request from hostname " + self.getHostName(clientHost) +
                              " (process " + identifier + ")\nwhich could not be parsed:\n'" + testString + "'\n")
         elif getFiles:
-            self.pushFiles(test)
+            self.pushFiles(test, rfile)
         elif not test.state.isComplete() or not test.state.hasResults():  # we might have killed it already...
             if sendFiles:
                 self.server.diag.info("Test " + test.uniqueName +
                                       " - receiving files sent from slave to sandbox directory")
-                directoryUnserialise(test.writeDirectory, self.rfile)
+                directoryUnserialise(test.writeDirectory, rfile)
             # Don't use port, it changes all the time
-            self.handleRequestFromHost(test, identifier, tryReuse, rerun)
+            self.handleRequestFromHost(test, identifier, tryReuse, rerun, rfile, wfile)
         else:
             self.server.diag.info("Test " + test.uniqueName + " already complete, ignoring new results")
-            self.sendReuseResponse(test, test.state, tryReuse, False)
-        self.connection.shutdown(socket.SHUT_RDWR)
+            self.sendReuseResponse(wfile, test, test.state, tryReuse, False)
 
     def getHostName(self, ipAddress):
         try:
@@ -995,35 +1024,36 @@ class SlaveRequestHandler(StreamRequestHandler):
         except socket.error:
             return ipAddress
 
-    def pushFiles(self, test):
+    def pushFiles(self, test, rfile):
         encoding = getpreferredencoding()
-        userAndHost = str(self.rfile.readline().strip(), encoding)
+        userAndHost = str(rfile.readline().strip(), encoding)
         paths = []
-        for line in self.rfile:
+        for line in rfile:
             paths.append(str(line.strip(), encoding))
         self.server.pushFiles(test, userAndHost, paths)
 
-    def sendReuseResponse(self, *args):
+    def sendReuseResponse(self, wfile, *args):
         newTest = QueueSystemServer.instance.getTestForReuse(*args)
         if newTest:
             response = socketSerialise(newTest)
             self.server.diag.info("Sending reuse response " + response)
-            self.wfile.write(response.encode(getpreferredencoding()))
+            wfile.write(response.encode(getpreferredencoding()))
 
-    def handleRequestFromHost(self, test, pid, tryReuse, rerun):
+    def handleRequestFromHost(self, test, pid, tryReuse, rerun, rfile, wfile):
         # The updates are only for testing against old slave traffic,
         # a bit sad we can't disable them when not testing...
-        _, state = test.getNewState(self.rfile, updatePaths=True)
+        _, state = test.getNewState(rfile, updatePaths=True)
         if test.state.isComplete():
             state.lifecycleChange = "recalculated"
         doneRerun = self.server.changeStateOrRerun(test, state, rerun)
-        try:
-            self.connection.shutdown(socket.SHUT_RD)
-        except socket.error:
-            # This only occurs on a mac, and doesn't affect functionality.
-            pass
+        if rfile is self.rfile:
+            try:
+                self.connection.shutdown(socket.SHUT_RD)
+            except socket.error:
+                # This only occurs on a mac, and doesn't affect functionality.
+                pass
         if state.isComplete():
-            self.sendReuseResponse(test, state, tryReuse, doneRerun)
+            self.sendReuseResponse(wfile, test, state, tryReuse, doneRerun)
         else:
             QueueSystemServer.instance.setRemoteProcessId(test, pid)
 
@@ -1032,6 +1062,8 @@ class SlaveServerResponder(plugins.Responder, ThreadingTCPServer):
     # Python's default value of 5 isn't very much...
     # There doesn't seem to be any disadvantage of allowing a longer queue, so we will use the system's maximum size
     request_queue_size = socket.SOMAXCONN
+    # Slaves with persistent connections may still have them open when we're done
+    daemon_threads = True
 
     def __init__(self, optionMap, allApps):
         plugins.Responder.__init__(self)
@@ -16,6 +16,7 @@ from texttestlib.default.sandbox import FindExecutionHosts, MachineInfoFinder
 from texttestlib.default.actionrunner import ActionRunner
 from texttestlib.utils import getUserName
 from pickle import dumps
+from tempfile import SpooledTemporaryFile
 from locale import getpreferredencoding
 
 
@@ -70,13 +71,16 @@ class RedirectLogResponder(plugins.Responder):
 class SocketResponder(plugins.Responder, plugins.Observable):
     synchFiles = False
 
-    def __init__(self, optionMap, *args):
+    def __init__(self, optionMap, allApps):
         plugins.Responder.__init__(self)
         plugins.Observable.__init__(self)
         self.killed = False
         self.transferAll = optionMap.get("keepslave") or optionMap.get("keeptmp")
         self.testsForRerun = []
         self.serverAddress = self.getServerAddress(optionMap)
+        self.persistent = all((app.getConfigValue("queue_system_persistent_connection") for app in allApps))
+        self.connection = None
+        self.connectionFile = None
 
     def getServerAddress(self, optionMap):
         servAddrStr = optionMap.get("servaddr", os.getenv("CAPTUREMOCK_SERVER"))
@@ -120,22 +124,30 @@ class SocketResponder(plugins.Responder, plugins.Observable):
         protocol = int(os.getenv("TEXTTEST_PICKLE_PROTOCOL", 2)) # Which pickle protocol to use. Useful to set to plain text for self-tests.
         pickleData = dumps(state, protocol=protocol)
         sendFiles = self.synchFiles and changeDesc == "complete" and (self.transferAll or not test.state.hasSucceeded())
-        fullData = self.getProcessIdentifier(test, sendFiles) + os.linesep + testData + os.linesep
+        header = self.getProcessIdentifier(test, sendFiles) + os.linesep + testData + os.linesep
+        headerBytes = header.encode(getpreferredencoding())
         if sendFiles:
-            fullData += directorySerialise(test.writeDirectory) + os.linesep
-        fullDataBytes = fullData.encode(getpreferredencoding()) + pickleData
-        return self.sendAndInterpret(fullDataBytes, self.interpretResponse, state)
+            # Sandboxes can be large, don't keep them in memory
+            with SpooledTemporaryFile(max_size=transferBlockSize) as fullData:
+                fullData.write(headerBytes)
+                directorySerialise(test.writeDirectory, fullData)
+                fullData.write(pickleData)
+                return self.sendAndInterpret(fullData, self.interpretResponse, state)
+        else:
+            return self.sendAndInterpret(headerBytes + pickleData, self.interpretResponse, state)
 
     def sendAndInterpret(self, fullData, responseMethod, *args):
         sleepTime = 1
         for _ in range(9):
-            sendSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            if not self.connect(sendSocket):
-                return self.notify("NoMoreExtraTests")
             try:
+                sendSocket = self.getSocket()
+                if sendSocket is None:
+                    return self.notify("NoMoreExtraTests")
                 response = self.sendData(sendSocket, fullData)
                 return responseMethod(response, *args) if responseMethod else True
             except socket.error as e:
+                # Reconnect next time, if we had a persistent connection
+                self.closeConnection()
                 plugins.log.info("Failed to communicate with master process - waiting " +
                                  str(sleepTime) + " seconds and then trying again.")
                 plugins.log.info("Error received was " + str(e))
@@ -147,8 +159,38 @@ class SocketResponder(plugins.Responder, plugins.Observable):
         plugins.log.info(message.strip())
         self.notify("NoMoreExtraTests")
 
+    def getSocket(self):
+        if self.connection:
+            return self.connection
+
+        sendSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if not self.connect(sendSocket):
+            return
+        if self.persistent:
+            if self.synchFiles:
+                # See sendData below
+                sendSocket.settimeout(25)
+            sendSocket.sendall((persistentConnectionText + "\n").encode(getpreferredencoding()))
+            self.connection = sendSocket
+            self.connectionFile = sendSocket.makefile("rb")
+        return sendSocket
+
+    def closeConnection(self):
+        if self.connection:
+            self.connectionFile.close()
+            self.connection.close()
+            self.connection = None
+            self.connectionFile = None
+
     def sendData(self, sendSocket, fullData):
-        sendSocket.sendall(fullData)
+        if sendSocket is self.connection:
+            sendFrame(sendSocket, fullData)
+            response = readFrame(self.connectionFile)
+            if response is None:
+                raise socket.error("Connection closed by master process")
+            return str(response, getpreferredencoding())
+
+        sendAllData(sendSocket, fullData)
         sendSocket.shutdown(socket.SHUT_WR)
         if self.synchFiles:
             # Remote socket, possibly firewalls that kill connections, possibly other things. Use timeout and be prepared to retry...
@@ -164,6 +206,7 @@ class SocketResponder(plugins.Responder, plugins.Observable):
             appParts = appDesc.split(".")
             self.notify("ExtraTest", testPath, appParts[0], appParts[1:])
         elif state.isComplete():
+            self.closeConnection()
             self.notify("NoMoreExtraTests")
 
     def notifyRequiredTestData(self, test, paths):
@@ -182,6 +225,9 @@ class SlaveActionRunner(ActionRunner):
         if len(goodSuites) == 0:
             ActionRunner.notifyAllRead(self, goodSuites)
 
+    def getWorkerCount(self):
+        return 1  # the master decides how many tests run at once
+
     def notifyRerun(self, *args):
         pass  # don't rerun directly in the slave, tell the master and give it a chance to send the job elsewhere
 
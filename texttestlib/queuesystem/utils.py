@@ -4,7 +4,12 @@ Utilities for both master and slave code
 """
 
 import os
+import gzip
 import socket
+import struct
+import shutil
+import tarfile
+from itertools import chain
 from texttestlib import plugins
 from locale import getpreferredencoding
 
@@ -12,6 +17,13 @@ noReusePostfix = ".NO_REUSE"
 rerunPostfix = ".RERUN_TEST"
 sendFilePostfix = ".SEND_FILES"
 getFilePostfix = ".GET_FILES"
+# Sent first by slaves that keep their connection open and send length-prefixed messages on it
+persistentConnectionText = "PERSISTENT_CONNECTION"
+frameHeader = struct.Struct("!Q")
+# Sandbox directories are sent as a compressed tar archive, split into chunks each prefixed with their length
+archiveText = "ARCHIVE_CONTENTS"
+chunkHeader = struct.Struct("!I")
+transferBlockSize = 1024 * 1024
 
 
 def getIPAddress(apps):
@@ -48,6 +60,75 @@ def socketParse(testString):
     return testString.strip().split(":", 1)
 
 
+def getDataSize(data):
+    # Data to send is either bytes, or a file for things too large to keep in memory
+    if isinstance(data, bytes):
+        return len(data)
+    data.seek(0, os.SEEK_END)
+    return data.tell()
+
+
+def sendAllData(sendSocket, data):
+    if isinstance(data, bytes):
+        sendSocket.sendall(data)
+    else:
+        data.seek(0)
+        for block in iter(lambda: data.read(transferBlockSize), b""):
+            sendSocket.sendall(block)
+
+
+def sendFrame(sendSocket, data):
+    sendSocket.sendall(frameHeader.pack(getDataSize(data)))
+    sendAllData(sendSocket, data)
+
+
+def readFrame(f):
+    # Returns None if the connection was closed before a whole message arrived
+    frame = openFrame(f)
+    if frame is not None:
+        data = frame.read()
+        if len(data) == frame.length:
+            return data
+
+
+def openFrame(f):
+    header = f.read(frameHeader.size)
+    if len(header) == frameHeader.size:
+        return FrameReader(f, frameHeader.unpack(header)[0])
+
+
+class FrameReader:
+    """ File-like access to one length-prefixed message, so it can be processed without reading it all first """
+    def __init__(self, f, length):
+        self.file = f
+        self.length = length
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        if len(data) < size:
+            self.remaining = 0  # connection closed
+        return data
+
+    def readline(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        line = self.file.readline(size)
+        self.remaining -= len(line)
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def finish(self):
+        # Skip anything the handler didn't read, so the next message can be read
+        while self.read(transferBlockSize):
+            pass
+
+
 def makeIdentifierLine(identifier, sendFiles=False, getFiles=False, noReuse=False, rerun=False):
     if sendFiles:
         identifier += sendFilePostfix
@@ -85,24 +166,95 @@ fileText = "FILE_CONTENTS"
 endPrefix = "END_"
 
 
-def directorySerialise(dirName, ignoreLinks=False):
-    text = ""
-    for root, _, files in os.walk(dirName):
-        for fn in sorted(files):
-            path = os.path.join(root, fn)
-            if not os.path.islink(path):
-                relpath = plugins.relpath(path, dirName)
-                text += fileText + " " + relpath + "\n"
-                with open(path) as f:
-                    text += f.read()
-                if not text.endswith("\n"):
-                    text += "\n"
-                text += endPrefix + fileText + "\n"
-    text += endPrefix + dirText
-    return text
+class ChunkWriter:
+    """ Writes data as a series of chunks, so the reader can tell where it ends without knowing its size in advance """
+    def __init__(self, f):
+        self.file = f
+
+    def write(self, data):
+        if len(data):
+            self.file.write(chunkHeader.pack(len(data)))
+            self.file.write(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # An empty chunk marks the end
+        self.file.write(chunkHeader.pack(0))
+
+
+class ChunkReader:
+    """ Reads what a ChunkWriter wrote, reporting end of file at the empty chunk, and not reading beyond it """
+    def __init__(self, f):
+        self.file = f
+        self.buffer = b""
+        self.finished = False
+
+    def readChunk(self):
+        header = self.file.read(chunkHeader.size)
+        length = chunkHeader.unpack(header)[0] if len(header) == chunkHeader.size else 0
+        data = self.file.read(length)
+        if len(data) < length:
+            raise EOFError("Connection closed while receiving sandbox directory")
+        self.finished = length == 0
+        return data
+
+    def read(self, size=-1):
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            self.buffer += self.readChunk()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def finish(self):
+        while not self.finished:
+            self.readChunk()
+
+
+def directorySerialise(dirName, f):
+    # Compress with gzip, which also checksums the contents
+    f.write((archiveText + "\n").encode(getpreferredencoding()))
+    writer = ChunkWriter(f)
+    with gzip.GzipFile(fileobj=writer, mode="wb", compresslevel=1) as gzipFile:
+        with tarfile.open(fileobj=gzipFile, mode="w|", bufsize=transferBlockSize) as tarFile:
+            for root, _, files in os.walk(dirName):
+                for fn in sorted(files):
+                    path = os.path.join(root, fn)
+                    if not os.path.islink(path):
+                        tarFile.add(path, arcname=plugins.relpath(path, dirName), recursive=False)
+    writer.close()
 
 
 def directoryUnserialise(rootDir, f):
+    firstLine = f.readline()
+    if str(firstLine, getpreferredencoding()).strip() == archiveText:
+        archiveUnserialise(rootDir, f)
+    else:
+        textDirectoryUnserialise(rootDir, chain([firstLine], f))
+
+
+def archiveUnserialise(rootDir, f):
+    rootDir = os.path.normpath(rootDir)
+    reader = ChunkReader(f)
+    with gzip.GzipFile(fileobj=reader, mode="rb") as gzipFile:
+        with tarfile.open(fileobj=gzipFile, mode="r|") as tarFile:
+            for member in tarFile:
+                path = os.path.normpath(os.path.join(rootDir, member.name))
+                if member.isfile() and path.startswith(os.path.join(rootDir, "")):
+                    plugins.ensureDirExistsForFile(path)
+                    with open(path, "wb") as currFile:
+                        shutil.copyfileobj(tarFile.extractfile(member), currFile, transferBlockSize)
+        # Read to the end, so that gzip verifies the checksum
+        while gzipFile.read(transferBlockSize):
+            pass
+    reader.finish()
+
+
+def textDirectoryUnserialise(rootDir, f):
+    # The format used by older slaves
     currFile = None
     for line in f:
         lineStr = str(line, getpreferredencoding())
@@ -12,11 +12,12 @@ import functools
 import fnmatch
 
 from multiprocessing import cpu_count
+from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
-from pickle import Pickler, Unpickler, UnpicklingError
+from pickle import UnpicklingError
 from threading import Lock
 from tempfile import mkstemp, mkdtemp
-from copy import deepcopy
+from bisect import bisect_left
 from functools import reduce, cmp_to_key
 from locale import getpreferredencoding
 
@@ -28,6 +29,8 @@ http://www.texttest.org
 
 
 class DirectoryCache:
+    """ The files in a test's directory, read once and indexed by stem so that
+    looking up e.g. all versions of 'output' doesn't mean scanning the whole directory """
     def __init__(self, dir):
         self.dir = dir
         self.contents = []
@@ -35,19 +38,26 @@ class DirectoryCache:
 
     def refresh(self):
         try:
-            self.contents = os.listdir(self.dir)
-            self.contents.sort()
+            with os.scandir(self.dir) as entries:
+                self.contents = sorted(entry.name for entry in entries)
         except OSError:  # usually caused by people removing stuff externally
             self.contents = []
+        self.contentSet = set(self.contents)
+        # Each file name split at its first '.', in sorted order, and grouped by the first part
+        self.splitContents = []
+        self.stemIndex = {}
+        for fileName in self.contents:
+            stem, versionSet = self.splitStem(fileName)
+            self.splitContents.append((stem, versionSet))
+            self.stemIndex.setdefault(stem, []).append((fileName, versionSet))
+        self.subDirCaches = {}
 
     def hasStem(self, stem):
-        for fileName in self.contents:
-            if fileName.startswith(stem):
-                return True
-        return False
+        pos = bisect_left(self.contents, stem)
+        return pos < len(self.contents) and self.contents[pos].startswith(stem)
 
     def exists(self, fileName):
-        return fileName in self.contents
+        return fileName in self.contentSet
 
     def pathName(self, fileName):
         return os.path.join(self.dir, fileName)
@@ -66,18 +76,40 @@ class DirectoryCache:
         versionSets = self.findVersionSets(stem, extensionPred)
         return reduce(operator.add, list(versionSets.values()), [])
 
+    def getSubDirCache(self, root):
+        # Reuse caches for subdirectories, unless something has been added or removed there since
+        subDir = os.path.join(self.dir, root)
+        try:
+            modTime = os.stat(subDir).st_mtime_ns
+        except OSError:
+            modTime = None
+        cached = self.subDirCaches.get(root)
+        if cached is not None and cached[0] == modTime:
+            return cached[1]
+        newCache = DirectoryCache(subDir)
+        self.subDirCaches[root] = modTime, newCache
+        return newCache
+
+    def findIndexedVersionSets(self, stem):
+        firstPart = stem.split(".", 1)[0]
+        indexed = self.stemIndex.get(firstPart, [])
+        if stem == firstPart:
+            return indexed
+        # Stems like 'config.app' : the files that match are those that the extra parts identify exactly
+        prefix = stem + "."
+        return [(fileName, self.splitStem(fileName[len(stem):])[1])
+                for fileName, _ in indexed if fileName == stem or fileName.startswith(prefix)]
+
     def findVersionSets(self, stem, predicate):
         # added normpath, needs review MB 2018-12-07
         stem = os.path.normpath(stem)
         if os.sep in stem:
             root, local = os.path.split(stem)
-            newCache = DirectoryCache(os.path.join(self.dir, root))
-            return newCache.findVersionSets(local, predicate)
+            return self.getSubDirCache(root).findVersionSets(local, predicate)
 
         versionSets = OrderedDict()
-        for fileName in self.contents:
-            versionSet = self.findVersionSet(fileName, stem)
-            if versionSet is not None and (predicate is None or predicate(versionSet)):
+        for fileName, versionSet in self.findIndexedVersionSets(stem):
+            if predicate is None or predicate(versionSet):
                 versionSets.setdefault(versionSet, []).append(self.pathName(fileName))
         return versionSets
 
@@ -85,11 +117,11 @@ class DirectoryCache:
         return self.findAllStems(lambda stem, vset: fnmatch.fnmatch(stem, pattern))
 
     def findAllStems(self, predicate=None):
-        stems = []
-        for file in self.contents:
-            stem, versionSet = self.splitStem(file)
-            if len(stem) > 0 and stem not in stems and (predicate is None or predicate(stem, versionSet)):
+        stems, found = [], set()
+        for stem, versionSet in self.splitContents:
+            if len(stem) > 0 and stem not in found and (predicate is None or predicate(stem, versionSet)):
                 stems.append(stem)
+                found.add(stem)
         return stems
 
 
@@ -215,6 +247,8 @@ class Test(plugins.Observable):
         self.uniqueName = name
         self.app = app
         self.parent = parent
+        # Cached as selection filters ask for it for every test, reset when the test or one of its ancestors is renamed
+        self.relPath = None
         self.dircache = dircache
         self.configDir = None
         self.diag = logging.getLogger("test objects")
@@ -242,11 +276,11 @@ class Test(plugins.Observable):
 
     def reloadConfiguration(self):
         if self.hasLocalConfig():
-            parentConfigDir = self.getParentConfigDir()
-            newConfigDir = deepcopy(parentConfigDir)
+            newConfigDir = plugins.ConfigOverlay(self.getParentConfigDir())
             self.app.readValues(newConfigDir, "config", [self.dircache], insert=False, errorOnUnknown=True)
             self.configDir = newConfigDir
-            self.diagnose("config file settings are: " + "\n" + repr(self.configDir))
+            if self.diag.isEnabledFor(logging.INFO):
+                self.diagnose("config file settings are: " + "\n" + repr(self.configDir))
 
     def getConfigFileDefining(self, versionApp, sectionName, key, value):
         configDir = self.configDir or self.getParentConfigDir()
@@ -279,6 +313,7 @@ class Test(plugins.Observable):
         return self.name.ljust(maxLength)
 
     def changeDirectory(self, newDir, origRelPath):
+        self.relPath = None
         self.dircache = DirectoryCache(newDir)
         self.notify("NameChange", origRelPath)
 
@@ -581,6 +616,11 @@ class Test(plugins.Observable):
         return self.app.getDataFileNames(test=self)
 
     def getRelPath(self):
+        if self.relPath is None:
+            self.relPath = self.findRelPath()
+        return self.relPath
+
+    def findRelPath(self):
         if self.parent:
             parentPath = self.parent.getRelPath()
             if parentPath:
@@ -878,17 +918,40 @@ class TestCase(Test):
         return min(lastOptionIndex + 2, len(optionArgs))
 
     def listUnownedTmpPaths(self):
-        paths, ignoredPaths = [], []
-        filelist = os.listdir(self.localWriteDirectory)
-        filelist.sort()
-        for file in filelist:
-            if file in ["framework_tmp", "file_edits", "traffic_intercepts"] or file.endswith("." + self.app.name):
+        entries, ignoredPaths = self.listUnownedTmpEntries()
+        return [entry.path for entry in entries], ignoredPaths
+
+    def listUnownedTmpEntries(self):
+        # As listUnownedTmpPaths, but returns os.DirEntry objects, which know their type and cache their stat result
+        entries, ignoredPaths = [], []
+        for entry in sorted(os.scandir(self.localWriteDirectory), key=lambda e: e.name):
+            if entry.name in ["framework_tmp", "file_edits", "traffic_intercepts"] or entry.name.endswith("." + self.app.name):
                 continue
-            fullPath = os.path.join(self.localWriteDirectory, file)
-            newPaths, newIgnoredPaths = self.listFiles(fullPath, file, followLinks=False)
-            paths += newPaths
+            filesToIgnore = self.getCompositeConfigValue("test_data_ignore", entry.name)
+            newEntries, newIgnoredPaths = self.listEntriesFrom([entry], filesToIgnore)
+            entries += newEntries
             ignoredPaths += newIgnoredPaths
-        return paths, ignoredPaths
+        return entries, ignoredPaths
+
+    def listEntriesFrom(self, entries, filesToIgnore):
+        # Same order as listFilesFrom, without following links
+        entries.sort(key=lambda e: e.path)
+        dataEntries = []
+        ignoredPaths = []
+        dirs = []
+        for entry in entries:
+            if self.app.fileMatches(entry.name, filesToIgnore):
+                ignoredPaths.append(entry.path)
+            elif entry.is_dir(follow_symlinks=False):
+                dirs.append(entry)
+            else:
+                dataEntries.append(entry)
+        for subdir in dirs:
+            dataEntries.append(subdir)
+            newDataEntries, newIgnoredPaths = self.listEntriesFrom(list(os.scandir(subdir.path)), filesToIgnore)
+            dataEntries += newDataEntries
+            ignoredPaths += newIgnoredPaths
+        return dataEntries, ignoredPaths
 
     def makeTmpFileName(self, stem, forComparison=True, forFramework=False):
         local = not forComparison and not forFramework
@@ -915,7 +978,8 @@ class TestCase(Test):
         os.rename(newPath, os.path.join(os.path.dirname(newPath), "backup.aborted"))
         stateFile = self.getStateFile()
         if os.path.isfile(stateFile):
-            return plugins.getNewTestStateFromFile(open(stateFile))
+            with open(stateFile, "rb") as f:
+                return plugins.getNewTestStateFromFile(f)
 
     def backupPreviousTemporaryData(self, restoreLatest=False):
         writeDir = self.getDirectory(temporary=1)
@@ -973,8 +1037,7 @@ class TestCase(Test):
             return
 
         file = plugins.openForWrite(stateFile, "wb")
-        pickler = Pickler(file, protocol=2)
-        pickler.dump(self.state)
+        plugins.saveTestStateToFile(self.state, file)
         file.close()
 
     def isAcceptedBy(self, filter, *args):
@@ -1131,6 +1194,8 @@ class TestSuiteFileHandler:
 
 class TestSuite(Test):
     testSuiteFileHandler = TestSuiteFileHandler()
+    readPools = {}
+    readPoolLock = Lock()
 
     def __init__(self, name, description, dircache, app, parent=None):
         Test.__init__(self, name, description, dircache, app, parent)
@@ -1318,21 +1383,46 @@ class TestSuite(Test):
             return sorted(testNames, key=cmp_to_key(lambda a, b: self.compareTests(False, testCaseNames, a, b)))
 
     def createTestCases(self, filters, testNames, initial, guideSuite=None):
-        testCaches = {}
+        # Don't read anything for tests the filters can reject from their path alone
+        testNamesOrPaths = [t for t in testNames.keys() if self.mightAccept(os.path.basename(t), filters)]
+        testCaches = self.createTestCaches(testNamesOrPaths)
         testCaseNames = []
         if self.autoSortOrder:
-            for testName in list(testNames.keys()):
-                dircache = self.createTestCache(testName)
-                testCaches[testName] = dircache
-                if not dircache.hasStem("testsuite"):
+            for testName in testNamesOrPaths:
+                if not testCaches[testName]().hasStem("testsuite"):
                     testCaseNames.append(testName)
 
-        for testNameOrPath in self.getOrderedTestNames(list(testNames.keys()), testCaseNames):
+        for testNameOrPath in self.getOrderedTestNames(testNamesOrPaths, testCaseNames):
             testName = os.path.basename(testNameOrPath)
-            dirCache = testCaches.get(testName, self.createTestCache(testNameOrPath))
+            dirCache = testCaches[testNameOrPath]()
             desc = testNames.get(testNameOrPath)
             self.createTestOrSuite(testName, desc, dirCache, filters, initial, guideSuite)
 
+    def mightAccept(self, testName, filters):
+        relPath = os.path.join(self.getRelPath(), testName)
+        for filter in filters:
+            if not filter.acceptsTestPath(self, relPath):
+                self.diagnose("Not reading " + relPath + " due to " + repr(filter))
+                return False
+        return True
+
+    def createTestCaches(self, testNamesOrPaths):
+        # Reading directories is mostly waiting for the file system, so start reading them all in parallel if allowed.
+        # Returns a method for each test to get its cache when it's needed
+        threadCount = self.getConfigValue("test_suite_read_threads")
+        if threadCount > 1 and len(testNamesOrPaths) > 1:
+            pool = self.getReadPool(threadCount)
+            return {t: pool.submit(DirectoryCache, os.path.join(self.getDirectory(), t)).result for t in testNamesOrPaths}
+        else:
+            return {t: functools.partial(self.createTestCache, t) for t in testNamesOrPaths}
+
+    @classmethod
+    def getReadPool(cls, threadCount):
+        with cls.readPoolLock:
+            if threadCount not in cls.readPools:
+                cls.readPools[threadCount] = ThreadPoolExecutor(threadCount, thread_name_prefix="TestSuiteReader")
+            return cls.readPools[threadCount]
+
     def createTestOrSuite(self, testName, description, dirCache, filters, initial=True, guideSuite=None):
         className = self.getSubtestClass(dirCache)
         subTest = self.createSubtest(testName, description, dirCache, className)
@@ -1533,7 +1623,8 @@ class Application(object):
         self.inputOptions = inputOptions
         self.configDir = plugins.MultiEntryDictionary(importKey="import_config_file", importFileFinder=self.configPath)
         self.overrideConfigDir = {}
-        self.setUpConfiguration(configEntries)
+        with plugins.startupProfiler.phase("config reading"):
+            self.setUpConfiguration(configEntries)
         self.checkSanity()
         self.writeDirectory, self.localWriteDirectory = self.getWriteDirectories()
         self.rootTmpDir = os.path.dirname(self.writeDirectory)
@@ -1690,7 +1781,8 @@ class Application(object):
                 # Allow config modules to be stored under the test suite
                 sys.path.insert(0, dircache.pathName("texttest_config_modules"))
         try:
-            return plugins.importAndCall(moduleName, "getConfig", self.inputOptions)
+            with plugins.startupProfiler.phase("config module imports"):
+                return plugins.importAndCall(moduleName, "getConfig", self.inputOptions)
         except Exception as err:
             if isinstance(err, ImportError):
                 if plugins.isModuleMissing(str(err), moduleName):
@@ -1910,6 +2002,8 @@ class Application(object):
                               "Directories to be copied to the sandbox, and merged together")
         self.setConfigDefault("copy_test_path_script", {"default": ""},
                               "Script to use when copying data files, instead of straight copy")
+        self.setConfigDefault("copy_test_path_hardlink", [],
+                              "Copied test data that tests never write to, whose files can be hard linked into the sandbox instead")
         self.setConfigDefault("link_test_path", [], "Paths to be linked from the temp. directory when running tests")
         self.setConfigDefault("test_data_ignore", {"default": []},
                               "Elements under test data structures which should not be viewed or change-monitored")